@@ -6,7 +6,6 @@ LLM communication, plan management, command execution, safety checks, and loggin
 
 import os
 import json
-import nest_asyncio
 from flask import Flask, request, jsonify, render_template
 from flask_cors import CORS
 from flask_socketio import SocketIO
@@ -17,11 +16,12 @@ from modules.safety_checker import SafetyChecker
 from modules.execution_engine import ExecutionEngine
 from modules.logger import Logger
 
-# Apply nest_asyncio to make asyncio play nice with Flask
-nest_asyncio.apply()
-
 # Initialize Flask app
 app = Flask(__name__)
+# Plans can carry large command outputs: always send compact JSON (debug mode would pretty-print)
+# and keep keys in insertion order instead of sorting every response.
+app.json.compact = True
+app.json.sort_keys = False
 CORS(app)
 socketio = SocketIO(app, cors_allowed_origins="*")
 
@@ -85,6 +85,9 @@ def reject_plan():
     # Log the plan rejection
     logger.log_plan_rejection(plan_id, feedback)
     
+    # Asking the same thing again should not replay the rejected plan
+    llm_integration.forget_plan_response(plan_id)
+    
     # Request a revised plan if feedback is provided
     if feedback:
         revised_plan = llm_integration.revise_plan(plan_id, feedback)
@@ -181,7 +184,7 @@ def abort_plan():
 @app.route('/api/plan/<plan_id>', methods=['GET'])
 def get_plan(plan_id):
     """Get a specific plan by ID."""
-    plan = llm_integration.plans.get(plan_id)
+    plan = llm_integration.get_plan(plan_id)
     
     if not plan:
         return jsonify({'error': 'Plan not found'}), 404
@@ -24,6 +24,8 @@ class Config:
     # LLM Command Generation configuration
     USE_LLM_COMMAND_GENERATION = os.environ.get('USE_LLM_COMMAND_GENERATION', 'True').lower() == 'true'
     COMMAND_TEMPERATURE = float(os.environ.get('COMMAND_TEMPERATURE', '0.2'))  # Lower for more deterministic commands
+    COMMAND_CACHE_SIZE = int(os.environ.get('COMMAND_CACHE_SIZE', '1024'))  # Generated commands kept per task description
+    LLM_NEGATIVE_CACHE_SIZE = int(os.environ.get('LLM_NEGATIVE_CACHE_SIZE', '512'))  # Tasks whose LLM command was rejected
     
     # Logging configuration
     LOG_DIR = os.environ.get('LOG_DIR', 'logs')
@@ -47,6 +49,8 @@ class Config:
     
     # System configuration
     MAX_EXECUTION_TIME = int(os.environ.get('MAX_EXECUTION_TIME', 300))  # seconds
+    EXECUTION_LOCATION = os.environ.get('EXECUTION_LOCATION')  # Working directory for commands (None = current)
+    MAX_OUTPUT_SIZE = int(os.environ.get('MAX_OUTPUT_SIZE', 1024 * 1024))  # Characters of stdout/stderr kept per command
     
     # User interaction configuration
     HUMAN_VALIDATION_REQUIRED = os.environ.get('HUMAN_VALIDATION_REQUIRED', 'True').lower() == 'true'
@@ -54,10 +58,17 @@ class Config:
 
     # Cache configuration
     PLAN_CACHE_SIZE = int(os.environ.get('PLAN_CACHE_SIZE', '128'))
+    REVISION_CACHE_ENABLED = os.environ.get('REVISION_CACHE_ENABLED', 'True').lower() == 'true'  # Set to False to debug revisions
+    REVISION_CACHE_SIZE = int(os.environ.get('REVISION_CACHE_SIZE', '64'))
+    PLAN_RESPONSE_CACHE_SIZE = int(os.environ.get('PLAN_RESPONSE_CACHE_SIZE', '64'))  # LLM plan responses kept per user request (0 disables)
+    LLM_RESPONSE_CACHE_SIZE = int(os.environ.get('LLM_RESPONSE_CACHE_SIZE', '256'))  # Gemini responses kept per exact prompt (0 disables)
 
     # ThreadPoolExecutor configuration for LLM calls
     LLM_MAX_WORKERS = int(os.environ.get('LLM_MAX_WORKERS', '4')) # Max concurrent LLM API calls
     LLM_TIMEOUT = int(os.environ.get('LLM_TIMEOUT', '60')) # Timeout in seconds for an LLM call
+    LLM_MAX_RETRIES = int(os.environ.get('LLM_MAX_RETRIES', '2')) # Retries for rate-limited (429) or 5xx Gemini responses
+    LLM_RETRY_BACKOFF = float(os.environ.get('LLM_RETRY_BACKOFF', '1.0')) # Base delay in seconds, doubled per retry
+    LLM_OUTPUT_SLICE = int(os.environ.get('LLM_OUTPUT_SLICE', '2048')) # Max chars of each stdout/stderr sent to the LLM (head and tail kept)
 
 class DevelopmentConfig(Config):
     """Development configuration."""
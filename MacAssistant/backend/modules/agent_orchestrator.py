@@ -4,9 +4,13 @@ Manages the execution of plans, including handling acceptance, rejection,
 and revisions of plans, as well as the execution of individual commands.
 """
 
+import copy
+import hashlib
+import json
 import time
 from flask_socketio import emit
 from config import active_config
+from modules.llm_integration import LRUCache, clip_output
 
 class AgentOrchestrator:
     """Class for orchestrating plan execution."""
@@ -32,6 +36,10 @@ class AgentOrchestrator:
         self.active_plans = {}
         self.pending_commands = {}
         
+        # Cache revised plans so an identical failure doesn't trigger another LLM round-trip
+        self.revision_cache_enabled = getattr(active_config, 'REVISION_CACHE_ENABLED', True)
+        self.revision_cache = LRUCache(max_size=getattr(active_config, 'REVISION_CACHE_SIZE', 64))
+        
     def execute_plan(self, plan_id):
         """
         Begin executing a plan.
@@ -70,6 +78,9 @@ class AgentOrchestrator:
         # Debug output for plan details
         print(f"DEBUG: Plan details: {plan}")
         
+        # Classify observation steps once, up front, instead of on every step run
+        self._classify_observation_steps(plan.get('steps', []))
+
         # Update plan status
         plan['status'] = 'executing'
         self.active_plans[plan_id] = plan
@@ -77,6 +88,20 @@ class AgentOrchestrator:
         # Begin execution of the first step
         self._execute_step(plan_id, 0)
 
+    def _classify_observation_steps(self, steps):
+        """
+        Normalize the 'is_observe' flag on every step of a plan.
+        
+        Done once when a plan (or a revision of it) is ingested, so that truthy
+        non-bool values from the LLM are stored as plain booleans.
+        
+        Args:
+            steps (list): The plan steps to normalize in place
+        """
+        for step in steps:
+            if isinstance(step, dict):
+                step['is_observe'] = bool(step.get('is_observe', False))
+
     # --- _execute_step Refactoring Helpers ---
     def _prepare_step_command(self, plan_id, step_index, step):
         """
@@ -422,6 +447,7 @@ class AgentOrchestrator:
 
         # If updated_steps is not None and not an error indicator, it means the LLM is giving new instructions
         if updated_steps_list: # updated_steps_list should be a list of step dicts
+            self._classify_observation_steps(updated_steps_list)
             # Overwrite the plan’s next steps
             new_plan_steps = plan['steps'][:completed_step_index + 1] + updated_steps_list
             plan['steps'] = new_plan_steps
@@ -456,8 +482,8 @@ class AgentOrchestrator:
         self._emit_status_update(plan_id)
         
         # Request a revised plan with execution results
-        step_results = plan.get('step_results', {})
-        revised_plan_data = self.llm_integration.revise_plan(plan_id, feedback, step_results)
+        step_results = self._compact_step_results(plan_id, plan.get('step_results', {}))
+        revised_plan_data = self._revise_plan_cached(plan_id, feedback, step_results)
         
         if 'error' in revised_plan_data or not revised_plan_data.get('id'):
             self.logger.log_error(f"Plan revision failed for plan {plan_id}. Error: {revised_plan_data.get('error', 'Unknown revision error')}")
@@ -476,6 +502,7 @@ class AgentOrchestrator:
              del self.active_plans[plan_id]
         
         # Add the revised plan
+        self._classify_observation_steps(revised_plan_data.get('steps', []))
         self.active_plans[revised_plan_data['id']] = revised_plan_data
         
         # Include the revision summary in the update
@@ -492,6 +519,70 @@ class AgentOrchestrator:
         
         return revised_plan_data
     
+    def _compact_step_results(self, plan_id, step_results):
+        """
+        Clip each step's stdout/stderr before it is sent to the LLM.
+        
+        Args:
+            plan_id (str): The ID of the plan (for logging)
+            step_results (dict): Results of already executed steps
+            
+        Returns:
+            dict: A copy of step_results with stdout/stderr clipped to LLM_OUTPUT_SLICE chars
+        """
+        output_slice = getattr(active_config, 'LLM_OUTPUT_SLICE', 2048)
+        compact_results = {}
+        truncated_steps = []
+        for step_number, result in step_results.items():
+            stdout = result.get('stdout') or ''
+            stderr = result.get('stderr') or ''
+            if len(stdout) > output_slice or len(stderr) > output_slice:
+                truncated_steps.append(step_number)
+            # Same policy as the prompt builders, so the LLM sees one consistent view of the output
+            compact_results[step_number] = {
+                **result,
+                'stdout': clip_output(stdout, output_slice),
+                'stderr': clip_output(stderr, output_slice),
+            }
+
+        if truncated_steps:
+            self.logger.log_info(f"step_results_truncated: {{'plan_id': '{plan_id}', 'steps': {truncated_steps}, 'max_chars': {output_slice}}}")
+        return compact_results
+
+    def _revision_cache_key(self, plan_id, feedback, step_results):
+        """Build a stable cache key for a revision request."""
+        key_material = json.dumps([plan_id, feedback, step_results], sort_keys=True, default=str)
+        return hashlib.blake2b(key_material.encode('utf-8'), digest_size=16).hexdigest()
+
+    def _revise_plan_cached(self, plan_id, feedback, step_results):
+        """
+        Revise a plan, reusing a previous revision for an identical request.
+        
+        Args:
+            plan_id (str): The ID of the plan to revise
+            feedback (str): Feedback for the revision
+            step_results (dict): Results of already executed steps
+            
+        Returns:
+            dict: The revised plan data (or an error dictionary from the LLM integration)
+        """
+        if not self.revision_cache_enabled:
+            return self.llm_integration.revise_plan(plan_id, feedback, step_results)
+
+        cache_key = self._revision_cache_key(plan_id, feedback, step_results)
+        cached_plan = self.revision_cache.get(cache_key)
+        if cached_plan is not None:
+            self.logger.log_info(f"revision_cache_hit: {{'plan_id': '{plan_id}', 'revised_plan_id': '{cached_plan['id']}'}}")
+            # Hand out a fresh copy and re-store it so execution state from a previous run doesn't leak in
+            revised_plan_data = copy.deepcopy(cached_plan)
+            self.llm_integration.register_revised_plan(revised_plan_data, plan_id)
+            return revised_plan_data
+
+        revised_plan_data = self.llm_integration.revise_plan(plan_id, feedback, step_results)
+        if 'error' not in revised_plan_data and revised_plan_data.get('id'):
+            self.revision_cache.put(cache_key, copy.deepcopy(revised_plan_data))
+        return revised_plan_data
+    
     def abort_execution(self, plan_id):
         """
         Abort a plan execution.
@@ -6,29 +6,100 @@ Now supports LLM-based command generation for more complex tasks.
 
 import re
 import os
+import shlex
 import json
 import logging
 from config import active_config
-import google.genai as genai
-import google.genai.types as types
-import asyncio
-from concurrent.futures import ThreadPoolExecutor
+from modules.llm_integration import LRUCache, _TIME_SENSITIVE_RE
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
-# Reuse the global event loop from llm_integration.py
-# This should be imported from llm_integration to avoid duplication
-try:
-    from modules.llm_integration import global_loop
-except ImportError:
-    # Fallback in case the import fails
-    global_loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(global_loop)
+# Word tokens used for whole-word template keyword matching
+_WORD_RE = re.compile(r'\w+')
+
+# {name} placeholders in template commands
+_PLACEHOLDER_RE = re.compile(r'\{(.*?)\}')
+
+# Lines of a multi-line LLM response that look like a shell command: a common
+# command name as a whole word, a common flag, or shell operator characters
+_CMD_INDICATOR_RE = re.compile(
+    r'\b(?:ls|cd|grep|find|echo|cat|touch|mkdir|rm|cp|mv|python3?|open)\b'
+    r'|--version|(?<!\S)-[va]\b|[|><;]|&&'
+)
+
+# Fenced code block in an LLM response
+_CODE_BLOCK_RE = re.compile(r"```(?:bash|sh)?[ \t]*\n(.+?)```", re.DOTALL)
+
+# Substrings that make an LLM-generated command too dangerous to return,
+# folded into one alternation so the command is scanned once
+_DANGEROUS_COMMAND_RE = re.compile('|'.join(
+    re.escape(pattern)
+    for pattern in ("rm -rf /", "sudo rm", "> /dev/", "mkfs", "dd if=", ":(){ :|:& };:")
+))
+
+# System prompt for LLM command generation, kept terse since it is sent with every request
+_COMMAND_SYSTEM_PROMPT = """Return ONLY one executable macOS shell or AppleScript command for the task: no explanation, comments or backticks.
+Rules:
+- Prefer built-in macOS commands; shell commands for files, AppleScript or open -a for apps.
+- Quote and escape properly; be cautious with destructive operations (rm, sudo).
+- "Type <command>" -> return <command> itself, without echo.
+- "Check the version of X" -> X --version.
+- Observing output or human judgment needs no command -> a simple echo.
+Examples:
+Show CPU usage -> top -o cpu -n 5
+Open Safari -> open -a Safari
+Create a blank text file named notes.txt -> touch notes.txt
+Find all PNG images in Downloads folder -> find ~/Downloads -name '*.png'
+Note the output of the previous command -> echo 'Noted'"""
+
+class _SafeFormatDict(dict):
+    """Mapping for str.format_map that leaves unknown placeholders untouched."""
+    def __missing__(self, key):
+        return '{' + key + '}'
+
+# Task patterns, folded into one regex with a named group per handler so a single
+# match over the task description finds the matching pattern. Patterns must match
+# the whole (stripped) task, so a phrase inside a longer task never hijacks it.
+# Each entry is (handler name, regex source, command formatter); group names used
+# inside a pattern must be unique across the whole table.
+def _format_create_file(match):
+    """Build an echo-redirect command from a create-file match, quoting the file name and content."""
+    content = (match.group('content') or '').strip('\'"')
+    return f'echo {shlex.quote(content)} > {shlex.quote(match.group("filename"))}'
+
+_PATTERNS = (
+    ('create_file',
+     # Surrounding quotes on the content are stripped by the formatter
+     r'create (?:a )?file (?:named |called )?[\'"]?(?P<filename>[\w\.\-]+)[\'"]?(?: with contents? (?P<content>[^\n]*))?',
+     _format_create_file),
+    ('python_version',
+     r'(?:(?:check|show|get|print|display|what is) (?:the )?)?'
+     r'(?:python(?P<py3>3)?(?: --)?\s*version|version of python(?P<py3_of>3)?)[.?!]?',
+     lambda m: 'python3 --version' if (m.group('py3') or m.group('py3_of')) else 'python --version'),
+)
+
+_DISPATCH_RE = re.compile(
+    '|'.join(f'(?P<{name}>{source})' for name, source, _ in _PATTERNS),
+    re.IGNORECASE,
+)
+_HANDLERS = {name: formatter for name, _, formatter in _PATTERNS}
+
+# Fast path for tasks that start with a handler's leading phrase: only that handler's
+# own pattern is tried instead of the whole combined regex.
+_HANDLER_RES = {name: re.compile(source, re.IGNORECASE) for name, source, _ in _PATTERNS}
+_PREFIX_HANDLERS = (
+    ('create file', 'create_file'),
+    ('create a file', 'create_file'),
+)
+_PREFIXES = tuple(prefix for prefix, _ in _PREFIX_HANDLERS)
 
 class CommandGenerator:
     """Class for generating executable commands from task descriptions."""
     
+    # Parsed and normalized templates, shared by all instances and keyed by file path
+    _templates_cache = {}
+    
     def __init__(self):
         """Initialize the Command Generator."""
         
@@ -38,11 +109,20 @@ class CommandGenerator:
         self.use_llm = active_config.USE_LLM_COMMAND_GENERATION
         self.temperature = active_config.COMMAND_TEMPERATURE
         
-        # Initialize ThreadPoolExecutor for LLM calls within CommandGenerator
-        # It's a separate executor from the one in LLMIntegration,
-        # but can use the same configuration for number of workers and timeout.
-        self.executor = ThreadPoolExecutor(max_workers=getattr(active_config, 'LLM_MAX_WORKERS', 4))
-        logger.info(f"Initialized ThreadPoolExecutor with max_workers={self.executor._max_workers} for CommandGenerator")
+        # Command templates, with patterns and keywords lowercased once at load time.
+        # The file is read and parsed once per process, not once per instance.
+        self.templates_file = os.path.join(os.path.dirname(__file__), '../templates/command_templates.json')
+        templates = CommandGenerator._templates_cache.get(self.templates_file)
+        if templates is None:
+            templates = self._normalize_templates(self._load_templates())
+            CommandGenerator._templates_cache[self.templates_file] = templates
+        self.templates = templates
+        
+        # Bounded cache of generated commands, keyed on the task description
+        self.command_cache = LRUCache(max_size=getattr(active_config, 'COMMAND_CACHE_SIZE', 1024))
+
+        # Tasks whose LLM output was rejected, so they are not sent to the LLM again
+        self._llm_negative_cache = LRUCache(max_size=getattr(active_config, 'LLM_NEGATIVE_CACHE_SIZE', 512))
 
         # Check if LLM command generation is available
         if not self.api_key:
@@ -54,6 +134,30 @@ class CommandGenerator:
                 logger.info("LLM-based command generation is enabled")
             else:
                 logger.info("LLM-based command generation is disabled in configuration")
+
+        # Build the Gemini client and generation config once so every call reuses
+        # the same HTTP connection pool instead of re-creating it per task.
+        # The SDK call is synchronous, so LLM_TIMEOUT is enforced by the client itself.
+        # google.genai is only imported when LLM generation is actually in use.
+        self.timeout = getattr(active_config, 'LLM_TIMEOUT', 60)
+        self._genai_types = None
+        self._genai_client = None
+        self._generation_config = None
+        if self.llm_available:
+            from google import genai
+            from google.genai import types
+            self._genai_types = types
+            self._genai_client = genai.Client(
+                api_key=self.api_key,
+                http_options=types.HttpOptions(timeout=int(self.timeout * 1000)),  # milliseconds
+            )
+            self._generation_config = types.GenerateContentConfig(
+                system_instruction=_COMMAND_SYSTEM_PROMPT,
+                temperature=self.temperature,  # Lower temperature for more deterministic outputs
+                top_p=0.95,
+                top_k=40,
+                max_output_tokens=128,  # Limit output length for commands
+            )
     
     def generate_command(self, task_description):
         """
@@ -66,7 +170,50 @@ class CommandGenerator:
             str: An executable shell command or AppleScript
         """
         logger.info(f"Generating command for task: {task_description}")
+        task_lower = task_description.lower()
+        
+        # Surrounding whitespace never changes the generated command; case does
+        # (file names, contents), so the key is not lowercased
+        cache_key = task_description.strip()
+        cacheable = not _TIME_SENSITIVE_RE.search(task_description)
+        if cacheable:
+            command = self.command_cache.get(cache_key)
+            if command is not None:
+                logger.info(f"Command cache hit: {command}")
+                return command
         
+        command = self._generate_command_uncached(task_description, task_lower)
+        if command:
+            if cacheable:
+                self.command_cache.put(cache_key, command)
+            return command
+        
+        # Fall back to a simple echo command if no pattern matches
+        logger.warning(f"No command pattern match for: {task_description}")
+        return f'echo "No command generated for: {task_description}"'
+    
+    def _generate_command_uncached(self, task_description, task_lower):
+        """
+        Run the templates, the pattern fast path and then the LLM for a task description.
+        
+        Args:
+            task_description (str): A description of the task to perform
+            task_lower (str): The task description, lowercased
+            
+        Returns:
+            str: The generated command, or None if no command could be generated
+        """
+        # Try the command templates first
+        command = self._check_templates(task_description, task_lower)
+        if command:
+            logger.info(f"Template matched command: {command}")
+            return command
+        
+        # Then the local pattern fast path
+        command = self._process_patterns(task_description, task_lower)
+        if command:
+            logger.info(f"Pattern matched command: {command}")
+            return command
         
         # Use LLM-based command generation as a fallback
         if self.llm_available:
@@ -79,88 +226,181 @@ class CommandGenerator:
             except Exception as e:
                 logger.error(f"Error in LLM command generation: {e}")
         
-        # Fall back to a simple echo command if no pattern matches
-        logger.warning(f"No command pattern match for: {task_description}")
-        return f'echo "No command generated for: {task_description}"'
+        return None
     
-
+    def _load_templates(self):
+        """
+        Load command templates from the templates JSON file.
         
-    async def _async_generate_command_with_llm(self, task_description):
+        Returns:
+            dict: Templates with 'exact' and 'keywords' lists
         """
-        Generate a command using the LLM API asynchronously.
+        if os.path.exists(self.templates_file):
+            try:
+                with open(self.templates_file, 'r') as f:
+                    return json.load(f)
+            except Exception as e:
+                logger.error(f"Error loading command templates: {e}")
+        return {'exact': [], 'keywords': []}
+    
+    def _normalize_templates(self, templates):
+        """
+        Lowercase template patterns and keywords once so matching never re-lowercases them.
         
         Args:
-            task_description (str): A description of the task
+            templates (dict): Templates as loaded by _load_templates
             
         Returns:
-            str: A generated shell command
+            dict: The same templates, with lowercased patterns, an exact-pattern index, keyword sets and compiled extractors added
         """
-        try:
-            # System prompt for command generation
-            system_prompt = """
-            You are a command generation assistant for macOS. Given a task description, generate a single
-            executable shell command or AppleScript command that performs the task efficiently. 
-            Follow these guidelines:
-            
-            1. Return ONLY the command, with no explanation, comments, or backticks
-            2. Favor built-in macOS commands and utilities
-            3. Ensure the command is secure and follows best practices
-            4. For file operations, use shell commands (ls, cp, mv, etc.)
-            5. For application control, use AppleScript when appropriate
-            6. For long commands, use proper quoting and escaping
-            7. Be cautious with destructive operations (rm, sudo, etc.)
-            8. For instructions to 'type a command', just return that command directly - don't include "echo" or other wrappers
-            9. For version checks like "check the version of X", return "X --version"
-            10. If the task is to observe output or make a human judgment, no command is needed - return a simple echo command
-            
-            Examples:
-            - Task: "Show CPU usage" -> "top -o cpu -n 5"
-            - Task: "Open Safari" -> "open -a Safari" 
-            - Task: "Type python3 --version" -> "python3 --version"
-            - Task: "Check the version of npm" -> "npm --version"
-            - Task: "Create a blank text file named notes.txt" -> "touch notes.txt"
-            - Task: "Find all PNG images in Downloads folder" -> "find ~/Downloads -name '*.png'"
-            - Task: "Note the output of the previous command" -> "echo 'Noted'"
-            """
+        for template in templates.get('exact', []):
+            template['pattern_lc'] = template['pattern'].lower().strip()
+        # Exact templates indexed by lowercased pattern; the first template wins on duplicates
+        templates['_exact_index'] = {}
+        for template in templates.get('exact', []):
+            templates['_exact_index'].setdefault(template['pattern_lc'], template['command'])
+        for template in templates.get('keywords', []):
+            template['keywords_lc'] = [keyword.lower() for keyword in template['keywords']]
+            # Single words are matched against the task's word set; multi-word
+            # phrases still need a substring scan
+            template['kw_set'] = frozenset(k for k in template['keywords_lc'] if _WORD_RE.fullmatch(k))
+            template['kw_phrases'] = tuple(k for k in template['keywords_lc'] if not _WORD_RE.fullmatch(k))
+            # Compile extractors once instead of re-parsing them on every match
+            template['_placeholders'] = _PLACEHOLDER_RE.findall(template['command'])
+            template['_extractors_compiled'] = {
+                name: re.compile(extractor, re.IGNORECASE)
+                for name, extractor in template.get('extractors', {}).items()
+            }
+            # Format string for str.format_map: escape every brace, then re-open only
+            # the placeholders we can fill, so literal braces (awk etc.) survive
+            command_fmt = template['command'].replace('{', '{{').replace('}', '}}')
+            for name in template['_extractors_compiled']:
+                command_fmt = command_fmt.replace(f'{{{{{name}}}}}', f'{{{name}}}')
+            template['_command_fmt'] = command_fmt
+        
+        # Inverted index from one required word to the keyword templates that need it, so
+        # only templates sharing a word with the task are checked; templates made up of
+        # phrases only are always candidates
+        templates['_keyword_index'] = {}
+        templates['_phrase_only_templates'] = []
+        for index, template in enumerate(templates.get('keywords', [])):
+            if template['kw_set']:
+                templates['_keyword_index'].setdefault(min(template['kw_set']), []).append(index)
+            else:
+                templates['_phrase_only_templates'].append(index)
+        return templates
+    
+    def _check_templates(self, task_description, task_lower):
+        """
+        Match a task description against the command templates.
+        
+        Args:
+            task_description (str): A description of the task
+            task_lower (str): The task description, lowercased
             
-            # Combine prompts
-            combined_prompt = f"{system_prompt}\n\nTask: {task_description}\nCommand:"
+        Returns:
+            str: A command for the first matching template, or None if nothing matches
+        """
+        command = self.templates['_exact_index'].get(task_lower.strip())
+        if command is not None:
+            return command
+        
+        keyword_templates = self.templates.get('keywords', [])
+        if not keyword_templates:
+            return None
+        tokens = frozenset(_WORD_RE.findall(task_lower))
+        keyword_index = self.templates['_keyword_index']
+        candidates = set(self.templates['_phrase_only_templates'])
+        for token in tokens:
+            candidates.update(keyword_index.get(token, ()))
+        # Keep file order so earlier templates take priority
+        for index in sorted(candidates):
+            template = keyword_templates[index]
+            if not template['kw_set'] <= tokens:
+                continue
+            if not all(phrase in task_lower for phrase in template['kw_phrases']):
+                continue
+            values = {}
+            for name in template['_placeholders']:
+                extractor = template['_extractors_compiled'].get(name)
+                if extractor is None:
+                    continue
+                match = extractor.search(task_description)
+                if not match:
+                    break
+                values[name] = match.group(1).strip()
+            else:
+                return template['_command_fmt'].format_map(_SafeFormatDict(values))
+        return None
+    
+    def _process_patterns(self, task_description, task_lower):
+        """
+        Match a task description against the precompiled task patterns.
+        
+        Args:
+            task_description (str): A description of the task
+            task_lower (str): The task description, lowercased
             
-            # Call LLM API
-            client = genai.Client(api_key=self.api_key)
+        Returns:
+            str: A command for the pattern matching the whole task, or None if nothing matches
+        """
+        task = task_description.strip()
+        task_lower = task_lower.lstrip()
+        if task_lower.startswith(_PREFIXES):
+            for prefix, name in _PREFIX_HANDLERS:
+                if task_lower.startswith(prefix):
+                    match = _HANDLER_RES[name].fullmatch(task)
+                    return _HANDLERS[name](match) if match else None
+        
+        match = _DISPATCH_RE.fullmatch(task)
+        # The handler's outer group closes last, so lastgroup names the handler
+        return _HANDLERS[match.lastgroup](match) if match else None
+        
+    def _request_command_from_llm(self, task_description):
+        """
+        Ask the LLM for a command and sanity-check its response.
+        
+        Args:
+            task_description (str): A description of the task
             
-            # Configure generation parameters
-            generation_config = {
-                "temperature": self.temperature,  # Lower temperature for more deterministic outputs
-                "top_p": 0.95,
-                "top_k": 40,
-                "max_output_tokens": 256,  # Limit output length for commands
-            }
+        Returns:
+            str: A generated shell command
+        """
+        try:
+            # The system prompt travels in the generation config as system_instruction
+            prompt = f"Task: {task_description}\nCommand:"
             
-            response = client.models.generate_content(
+            # Stream the response with the shared client and prebuilt generation config,
+            # so generation can be cut off as soon as a usable command has arrived
+            stream = self._genai_client.models.generate_content_stream(
                 model=self.model,
-                contents=[types.Part.from_text(text=combined_prompt)],
-                generation_config=generation_config,
+                contents=[self._genai_types.Part.from_text(text=prompt)],
+                config=self._generation_config,
             )
             
             # Process response
-            command = response.text.strip()
+            command = self._read_command_stream(stream).strip()
             
             # Log the raw response for debugging
             logger.info(f"Raw LLM response: {command}")
             
-            # Remove any explanations or commentary
-            # If the response has multiple lines, try to find the actual command
-            if "\n" in command and not "```" in command:
-                # Look for a line that looks like a command (contains unix commands or typical symbols)
-                command_indicators = ['ls', 'cd', 'grep', 'find', 'echo', 'cat', 'touch', 'mkdir', 
-                                    'rm', 'cp', 'mv', 'python', 'python3', '--version', '-v', '|', 
-                                    'open', '-a', '>', '>>', '&&', '||', ';']
-                                    
+            if "```" in command:  # Command includes markdown code blocks
+                # A fenced block is the command; no need to scan lines for one
+                code_match = _CODE_BLOCK_RE.search(command)
+                if code_match:
+                    command = code_match.group(1).strip()
+                    logger.info(f"Extracted command from code block: {command}")
+                else:
+                    logger.warning(f"Could not extract command from code block: {command}")
+                    self._llm_negative_cache.put(task_description, True)
+                    return None
+            elif "\n" in command:
+                # Remove any explanations or commentary
+                # If the response has multiple lines, try to find the actual command
                 for line in command.split('\n'):
                     line = line.strip()
                     # Check if this line looks like a command
-                    if any(indicator in line for indicator in command_indicators) and len(line) < 100:
+                    if len(line) < 100 and _CMD_INDICATOR_RE.search(line):
                         command = line
                         logger.info(f"Selected likely command from multi-line response: {command}")
                         break
@@ -168,22 +408,13 @@ class CommandGenerator:
             # Sanity checks 
             if len(command) > 1000:  # Command too long
                 logger.warning(f"LLM generated command is too long: {len(command)} chars")
+                self._llm_negative_cache.put(task_description, True)
                 return None
-                
-            if "```" in command:  # Command includes markdown code blocks
-                # Try to extract just the command
-                code_match = re.search(r"```(?:bash|sh)?\n(.+?)```", command, re.DOTALL)
-                if code_match:
-                    command = code_match.group(1).strip()
-                    logger.info(f"Extracted command from code block: {command}")
-                else:
-                    logger.warning(f"Could not extract command from code block: {command}")
-                    return None
                     
             # Check for dangerous commands
-            dangerous_patterns = ["rm -rf /", "sudo rm", "> /dev/", "mkfs", "dd if=", ":(){ :|:& };:"]
-            if any(pattern in command for pattern in dangerous_patterns):
+            if _DANGEROUS_COMMAND_RE.search(command):
                 logger.warning(f"LLM generated potentially dangerous command: {command}")
+                self._llm_negative_cache.put(task_description, True)
                 return None
                 
             return command
@@ -192,6 +423,27 @@ class CommandGenerator:
             logger.exception(f"Error generating command with LLM: {e}")
             return None
             
+    def _read_command_stream(self, stream):
+        """
+        Accumulate a streamed LLM response, stopping early once it holds a closed code block.
+        
+        A closed code block is always the command _request_command_from_llm picks, so nothing
+        after it is needed. Anything else is read to the end: a response that opens with a
+        command-like line of prose may still be followed by a code block.
+        
+        Args:
+            stream: Iterable of response chunks from generate_content_stream
+            
+        Returns:
+            str: The accumulated response text
+        """
+        text = ''
+        for chunk in stream:
+            text += chunk.text or ''
+            if "```" in text and _CODE_BLOCK_RE.search(text):
+                break
+        return text
+    
     def _generate_command_with_llm(self, task_description):
         """
         Generate a command using the LLM API.
@@ -206,18 +458,16 @@ class CommandGenerator:
             logger.error("LLM command generation called but LLM is not available.")
             return None
 
-        # Submit the asyncio part to the executor, using the imported global_loop
-        future = self.executor.submit(global_loop.run_until_complete, self._async_generate_command_with_llm(task_description))
-        try:
-            timeout = getattr(active_config, 'LLM_TIMEOUT', 60) # Reuse LLM_TIMEOUT from config
-            command = future.result(timeout=timeout)
-            return command
-        except TimeoutError as e:
-            logger.error(f"Timeout waiting for LLM command generation ({timeout}s): {e}")
-            # Fallback or error propagation strategy:
-            # For now, returning None, but could raise a specific error.
-            return None 
-        except Exception as e:
-            logger.exception(f"Error getting result from executor for LLM command generation: {e}")
-            # Fallback or error propagation:
-            return None
\ No newline at end of file
+        # Skip the API call for strings that cannot be a task, and for tasks whose
+        # LLM output was already rejected (too long, dangerous or unparseable)
+        stripped = task_description.strip()
+        if len(stripped) < 3 or not any(c.isalpha() for c in stripped):
+            logger.info(f"Skipping LLM command generation for non-task input: {task_description!r}")
+            return None
+        if self._llm_negative_cache.get(task_description):
+            logger.info(f"Skipping LLM command generation for previously rejected task: {task_description}")
+            return None
+
+        # generate_content is a blocking SDK call, so call it directly rather than
+        # wrapping it in a coroutine and driving an event loop for it
+        return self._request_command_from_llm(task_description)
@@ -4,21 +4,56 @@ Executes commands on the macOS system and captures their output.
 """
 
 import os
+import re
+import shutil
 import subprocess
 import shlex
+import tempfile
+import threading
 import time
+from collections import deque
 import logging
 from config import active_config
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# Characters that need a real shell: expansions and escapes anywhere in the command,
+# and globbing / tilde / brace expansion in unquoted words
+_SHELL_EXPANSION_CHARS = ('$', '`', '\\')
+_UNQUOTED_EXPANSION_CHARS = ('*', '?', '[', '~', '{')
+# A leftover placeholder such as {filename}; ${HOME} parameter expansion, find's {}
+# and {a,b} brace expansion are not placeholders
+_UNSUBSTITUTED_PLACEHOLDER_RE = re.compile(r'(?<!\$)\{[A-Za-z_]\w*\}')
+# Single-quoted shell strings (awk/sed programs etc.), whose braces are literal text
+_SINGLE_QUOTED_RE = re.compile(r"'[^']*'")
+# File-descriptor redirects such as 2> or 2>&1
+_FD_REDIRECT_RE = re.compile(r'\d>')
+
+# Pipes are drained in chunks of this many characters
+_OUTPUT_CHUNK_SIZE = 4096
+
+def _drain_pipe(pipe, chunks, dropped):
+    """Read a pipe to EOF into a bounded deque of chunks, counting the characters dropped."""
+    for chunk in iter(lambda: pipe.read(_OUTPUT_CHUNK_SIZE), ''):
+        if len(chunks) == chunks.maxlen:
+            dropped[0] += len(chunks[0])
+        chunks.append(chunk)
+    pipe.close()
+
+def _truncation_notice(dropped):
+    """Marker prepended to output whose beginning was dropped."""
+    return f"[... {dropped} earlier characters of output truncated ...]\n"
+
 class ExecutionEngine:
     """Class for executing commands on the macOS system."""
     
     def __init__(self):
         """Initialize the Execution Engine."""
         self.max_execution_time = active_config.MAX_EXECUTION_TIME
+        self.execution_location = getattr(active_config, 'EXECUTION_LOCATION', None)
+        # Only the tail of each output stream is kept in memory
+        self.max_output_size = getattr(active_config, 'MAX_OUTPUT_SIZE', 1024 * 1024)
     
     def execute(self, command):
         """
@@ -35,8 +70,13 @@ class ExecutionEngine:
         """
         logger.info(f"Executing command: {command}")
         
-        # Determine if this is a shell command or AppleScript
-        if command.strip().startswith('tell application') or command.strip().startswith('osascript'):
+        # Strip once here; the executors and their backtick / 'open -a' checks
+        # all work on the stripped command
+        command = command.strip()
+        
+        # Determine if this is a shell command or AppleScript; osascript invocations
+        # are already shell commands and go straight to the shell path
+        if command.startswith('tell application'):
             logger.info("Detected AppleScript command")
             return self._execute_applescript(command)
         else:
@@ -54,10 +94,10 @@ class ExecutionEngine:
             tuple: (success, stdout, stderr)
         """
         try:
-            execution_location = os.environ.get('EXECUTION_LOCATION', None)
+            execution_location = self.execution_location
             
             # Check for unsubstituted placeholders or typical LLM formatting issues
-            if "{" in command and "}" in command:
+            if _UNSUBSTITUTED_PLACEHOLDER_RE.search(_SINGLE_QUOTED_RE.sub("''", command)):
                 logger.error(f"Command contains unsubstituted placeholder: {command}")
                 return False, "", f"Error: Command contains unsubstituted placeholder variables: {command}"
                 
@@ -83,62 +123,28 @@ class ExecutionEngine:
             
             # Split the command for security (prevents shell injection)
             # but use shell=True for commands with pipes, redirections, etc.
+            timeout_message = f"Command timed out after {self.max_execution_time} seconds"
             if '|' in command or '>' in command or '<' in command or '&' in command:
+                # A single pipe and/or a trailing > / >> redirect is run directly,
+                # without starting /bin/sh
+                pipeline = self._split_simple_pipeline(command)
+                if pipeline is not None:
+                    try:
+                        logger.info(f"Running simple pipeline without a shell: {pipeline}")
+                        return self._run_pipeline(*pipeline, execution_location, timeout_message)
+                    except OSError as e:
+                        # Raised only before any stage has started, so the shell can still run it
+                        logger.error(f"Error starting pipeline directly: {e}")
                 logger.info("Using shell=True for command with special characters")
-                process = subprocess.Popen(
-                    command,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    shell=True,
-                    text=True,
-                    cwd=execution_location
-                )
-            else:
-                try:
-                    args = shlex.split(command)
-                    logger.info(f"Parsed command args: {args}")
-                    process = subprocess.Popen(
-                        args,
-                        stdout=subprocess.PIPE,
-                        stderr=subprocess.PIPE,
-                        text=True,
-                        cwd=execution_location
-                    )
-                except Exception as e:
-                    logger.error(f"Error splitting command: {e}")
-                    logger.info("Falling back to shell=True")
-                    process = subprocess.Popen(
-                        command,
-                        stdout=subprocess.PIPE,
-                        stderr=subprocess.PIPE,
-                        shell=True,
-                        text=True,
-                        cwd=execution_location
-                    )
-            
-            # Set a timeout for the command
-            start_time = time.time()
-            
-            # Wait for the process to complete or timeout
-            while process.poll() is None:
-                if time.time() - start_time > self.max_execution_time:
-                    process.terminate()
-                    logger.warning(f"Command timed out after {self.max_execution_time} seconds")
-                    return False, "", f"Command timed out after {self.max_execution_time} seconds"
-                time.sleep(0.1)
-            
-            # Get the output
-            stdout, stderr = process.communicate()
-            
-            # Check return code
-            success = process.returncode == 0
-            
-            # Log results
-            logger.info(f"Command completed with return code: {process.returncode}")
-            logger.info(f"stdout: {stdout}")
-            logger.info(f"stderr: {stderr}")
-            
-            return success, stdout, stderr
+                return self._run_process(command, True, execution_location, timeout_message)
+            try:
+                args = shlex.split(command)
+                logger.info(f"Parsed command args: {args}")
+                return self._run_process(args, False, execution_location, timeout_message)
+            except Exception as e:
+                logger.error(f"Error splitting command: {e}")
+                logger.info("Falling back to shell=True")
+                return self._run_process(command, True, execution_location, timeout_message)
         
         except Exception as e:
             logger.error(f"Exception executing command: {str(e)}")
@@ -155,42 +161,248 @@ class ExecutionEngine:
             tuple: (success, stdout, stderr)
         """
         try:
-            execution_location = os.environ.get('EXECUTION_LOCATION', None)
-            
-            # Check if the script is already an osascript command
-            if script.strip().startswith('osascript'):
-                return self._execute_shell_command(script)
+            execution_location = self.execution_location
             
             # Wrap the script in osascript
             command = f'osascript -e \'{script}\''
             
             # Execute the command
-            process = subprocess.Popen(
-                command,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                shell=True,
-                text=True,
-                cwd=execution_location
-            )
+            timeout_message = f"AppleScript timed out after {self.max_execution_time} seconds"
+            return self._run_process(command, True, execution_location, timeout_message)
+        
+        except Exception as e:
+            return False, "", f"Error executing AppleScript: {str(e)}"
+    
+    def _run_process(self, args, shell, cwd, timeout_message):
+        """
+        Run a command to completion, blocking until it exits or times out.
+        
+        Args:
+            args (str or list): The command string (shell=True) or argument list
+            shell (bool): Whether to run the command through the shell
+            cwd (str): Working directory for the command, or None
+            timeout_message (str): Error reported if the command times out
             
-            # Set a timeout for the command
-            start_time = time.time()
+        Returns:
+            tuple: (success, stdout, stderr)
+        """
+        process = subprocess.Popen(
+            args,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            shell=shell,
+            text=True,
+            errors='replace',  # Undecodable output must not kill the pipe readers
+            cwd=cwd
+        )
+        try:
+            stdout, stderr = self._wait_bounded(process, [process.stdout, process.stderr])
+        except subprocess.TimeoutExpired:
+            logger.warning(timeout_message)
+            return False, "", timeout_message
+        
+        # Log results
+        logger.info(f"Command completed with return code: {process.returncode}")
+        logger.info(f"stdout: {stdout}")
+        logger.info(f"stderr: {stderr}")
+        
+        return process.returncode == 0, stdout, stderr
+    
+    def _wait_bounded(self, process, pipes, timeout=None):
+        """
+        Wait for a process while draining its pipes, keeping only the tail of each.
+        
+        Each pipe is read on its own thread into a deque of at most max_output_size
+        characters, so a chatty command cannot fill a pipe or exhaust memory.
+        
+        Args:
+            process (subprocess.Popen): The running process
+            pipes (list): Text-mode pipes to drain
+            timeout (float, optional): Seconds to wait; defaults to max_execution_time
             
-            # Wait for the process to complete or timeout
-            while process.poll() is None:
-                if time.time() - start_time > self.max_execution_time:
-                    process.terminate()
-                    return False, "", f"AppleScript timed out after {self.max_execution_time} seconds"
-                time.sleep(0.1)
+        Returns:
+            list: The (possibly truncated) output of each pipe, in order
             
-            # Get the output
-            stdout, stderr = process.communicate()
+        Raises:
+            subprocess.TimeoutExpired: If the process outlives the timeout; it is killed first
+        """
+        max_chunks = max(1, self.max_output_size // _OUTPUT_CHUNK_SIZE)
+        buffers = [(deque(maxlen=max_chunks), [0]) for _ in pipes]
+        threads = [
+            threading.Thread(target=_drain_pipe, args=(pipe, chunks, dropped), daemon=True)
+            for pipe, (chunks, dropped) in zip(pipes, buffers)
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            process.wait(timeout=self.max_execution_time if timeout is None else timeout)
+        except subprocess.TimeoutExpired:
+            # Don't join the readers: a grandchild of a killed shell may still hold
+            # the pipes open. The daemon threads end when the pipes close.
+            process.kill()
+            process.wait()
+            raise
+        for thread in threads:
+            thread.join()
+        
+        outputs = []
+        for chunks, dropped in buffers:
+            output = ''.join(chunks)
+            outputs.append(_truncation_notice(dropped[0]) + output if dropped[0] else output)
+        return outputs
+    
+    def _split_simple_pipeline(self, command):
+        """
+        Split a command with at most one pipe and an optional trailing > / >> redirect.
+        
+        Args:
+            command (str): The shell command to split
+            
+        Returns:
+            tuple: (stages, redirect_path, append), or None if the command needs a real shell;
+                stages is a list of (executable, argv) pairs with every executable already resolved
+        """
+        if any(char in command for char in _SHELL_EXPANSION_CHARS) or _FD_REDIRECT_RE.search(command):
+            return None
+        try:
+            # Non-POSIX mode keeps quotes on tokens, so quoted operators stay inside words
+            lexer = shlex.shlex(command, posix=False, punctuation_chars=True)
+            lexer.whitespace_split = True
+            tokens = list(lexer)
+        except ValueError:
+            return None
+        
+        redirect_path, append = None, False
+        if len(tokens) >= 2 and tokens[-2] in ('>', '>>'):
+            redirect_path, append = tokens[-1], tokens[-2] == '>>'
+            tokens = tokens[:-2]
+        
+        segments = [[]]
+        for token in tokens + ([redirect_path] if redirect_path else []):
+            quoted = token[0] in '\'"'
+            if not quoted and token[0] in '();<>|&' and token != '|':
+                return None
+            if not quoted and any(char in token for char in _UNQUOTED_EXPANSION_CHARS):
+                return None
+        for token in tokens:
+            if token == '|':
+                segments.append([])
+            else:
+                segments[-1].append(token)
+        if len(segments) > 2 or not all(segments):
+            return None
+        
+        try:
+            argv_lists = [shlex.split(' '.join(segment)) for segment in segments]
+            if redirect_path:
+                redirect_path = shlex.split(redirect_path)[0]
+        except (ValueError, IndexError):
+            return None
+        
+        # Resolve every stage up front so a missing program is reported by the shell
+        # before anything has run, rather than after earlier stages already executed
+        stages = []
+        for argv in argv_lists:
+            if not argv:
+                return None
+            program = argv[0]
+            if '/' in program and self.execution_location:
+                program = os.path.join(self.execution_location, program)
+            executable = shutil.which(program)
+            if executable is None:
+                return None
+            stages.append((executable, argv))
+        return stages, redirect_path, append
+    
+    def _run_pipeline(self, stages, redirect_path, append, cwd, timeout_message):
+        """
+        Run one or two commands connected by a pipe, optionally redirecting to a file.
+        
+        Args:
+            stages (list): (executable, argv) pairs, one per pipeline stage
+            redirect_path (str): File receiving the last stage's stdout, or None
+            append (bool): Append to redirect_path instead of truncating it
+            cwd (str): Working directory for the commands, or None
+            timeout_message (str): Error reported if the pipeline times out
             
-            # Check return code
-            success = process.returncode == 0
+        Returns:
+            tuple: (success, stdout, stderr)
             
-            return success, stdout, stderr
+        Raises:
+            OSError: If the redirect file can't be opened or the first stage can't be
+                started; nothing has run at that point
+        """
+        # One budget for the whole pipeline, shared by every stage's wait
+        deadline = time.monotonic() + self.max_execution_time
+        stdout_target = subprocess.PIPE
+        if redirect_path:
+            stdout_target = open(os.path.join(cwd or '', redirect_path), 'a' if append else 'w')
+        processes = []
+        launch_error = None
+        try:
+            # Every stage writes stderr to one file, like a shell writing to one terminal
+            with tempfile.TemporaryFile() as stderr_file:
+                try:
+                    stdin = None
+                    for index, (executable, argv) in enumerate(stages):
+                        last = index == len(stages) - 1
+                        try:
+                            process = subprocess.Popen(
+                                argv,
+                                executable=executable,
+                                stdin=stdin,
+                                stdout=stdout_target if last else subprocess.PIPE,
+                                stderr=stderr_file,
+                                text=True,
+                                errors='replace',
+                                cwd=cwd
+                            )
+                        except OSError as e:
+                            if not processes:
+                                raise
+                            # Earlier stages have already run, so the command must not be retried
+                            launch_error = e
+                            break
+                        if stdin is not None:
+                            stdin.close()  # Only the next stage holds the read end now
+                        stdin = process.stdout
+                        processes.append(process)
+                    if launch_error is not None:
+                        stdin.close()  # Nothing reads the last started stage's output
+                        stdout = ""
+                    else:
+                        stdout_pipes = [] if redirect_path else [processes[-1].stdout]
+                        stdout = (self._wait_bounded(processes[-1], stdout_pipes,
+                                                     max(0, deadline - time.monotonic())) or [""])[0]
+                    # The last stage was already waited for, unless it never started
+                    waiting = processes if launch_error is not None else processes[:-1]
+                    for process in waiting:
+                        process.wait(timeout=max(0, deadline - time.monotonic()))
+                except subprocess.TimeoutExpired:
+                    logger.warning(timeout_message)
+                    return False, "", timeout_message
+                finally:
+                    for process in processes:
+                        if process.poll() is None:
+                            process.kill()
+                            process.wait()
+                # Keep only the tail of stderr, as for single commands
+                size = stderr_file.seek(0, os.SEEK_END)
+                stderr_file.seek(max(0, size - self.max_output_size))
+                stderr = stderr_file.read().decode(errors='replace')
+                if size > self.max_output_size:
+                    stderr = _truncation_notice(size - self.max_output_size) + stderr
+        finally:
+            if redirect_path:
+                stdout_target.close()
         
-        except Exception as e:
-            return False, "", f"Error executing AppleScript: {str(e)}"
\ No newline at end of file
+        if launch_error is not None:
+            logger.error(f"Error starting pipeline stage: {launch_error}")
+            return False, "", f"{stderr}Error executing command: {launch_error}"
+        
+        returncode = processes[-1].returncode
+        logger.info(f"Command completed with return code: {returncode}")
+        logger.info(f"stdout: {stdout}")
+        logger.info(f"stderr: {stderr}")
+        
+        return returncode == 0, stdout, stderr
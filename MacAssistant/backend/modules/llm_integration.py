@@ -3,90 +3,288 @@ LLM Integration Module
 Handles communication with the Gemini LLM API for plan generation and revision.
 """
 
-import asyncio
+import hashlib
 import os
 import json
 import logging
+import random
 import re
-import google.genai as genai
-import google.genai.types as types # Fixed import
+import shlex
+import time
 from config import active_config
 import tempfile
-import shutil
-from collections import OrderedDict
+import threading
 from concurrent.futures import ThreadPoolExecutor
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Create a single global event loop to be reused
-# global_loop and its management strategy:
-# The `global_loop` is a single asyncio event loop created when this module is loaded.
-# `asyncio.set_event_loop(global_loop)` sets this loop as the default for the current (main) thread.
-# The primary purpose of this setup was to mitigate "Kqueue kqueue(2) error" issues on macOS
-# when running asyncio code (like Google's genai library calls) within a threaded environment
-# such as a Flask development server. These errors often arise from complexities in managing
-# multiple event loops or loop lifecycles across threads, or interactions with macOS's kqueue mechanism.
-#
-# Original approach: `global_loop.run_until_complete()` was called directly in methods like `_call_gemini_api`.
-# While this might have stabilized Kqueue issues by reusing a single loop, it made the async Gemini
-# calls blocking from the perspective of the Flask request handler thread.
-#
-# Current approach (with ThreadPoolExecutor):
-# The `_call_gemini_api` method now submits `global_loop.run_until_complete(self.async_call_gemini(...))`
-# to a `concurrent.futures.ThreadPoolExecutor`. This means:
-# 1. The actual execution of `run_until_complete` (and thus the Gemini API call) happens in a
-#    worker thread from the pool, not directly in the Flask request thread.
-# 2. The Flask request thread calls `future.result(timeout=...)`, which blocks *that specific request thread*
-#    until the Gemini call completes in the worker thread (or times out), but it allows other Flask request threads
-#    (if the server is multi-threaded) to handle other incoming requests concurrently.
-# 3. This isolates the `global_loop`'s activity to designated worker threads, which is hoped
-#    to maintain the Kqueue stability while allowing better concurrency for LLM operations.
-#
-# The `genai` library internally uses `asyncio.get_event_loop()` if its async methods are called
-# without an active loop. By calling `async_call_gemini` via `global_loop.run_until_complete`,
-# `global_loop` becomes the active loop during that execution within the worker thread.
-#
-# Retaining `asyncio.set_event_loop(global_loop)` in the main thread ensures that if any part of `genai`
-# (or other asyncio-dependent libraries) performs initialization that captures the default loop
-# when this module is imported, it captures `global_loop`. This is a defensive measure to ensure
-# consistent loop context for libraries that might expect `asyncio.get_event_loop()` to return
-# a specific loop if called during import time or from the main thread.
-global_loop = asyncio.new_event_loop()
-asyncio.set_event_loop(global_loop)
+# Patterns for pulling a JSON object out of an LLM response, compiled once
+_JSON_FENCE_RE = re.compile(r'```json\s*([\s\S]*?)\s*```')  # ```json fenced block
+_JSON_KEY_START_RE = re.compile(r'\s*"')  # Opening quote of an object's first key
+
+# Requests whose answer depends on the moment they are asked are never served from a cache
+_TIME_SENSITIVE_RE = re.compile(r'\b(?:now|current|currently|today|latest)\b', re.IGNORECASE)
+
+# Read-only utilities whose clean exit fully answers "did it work?", so verification skips the LLM.
+# Anything that can write, delete or run other programs (find -exec, top, sed -i, ...) is left out.
+_READ_ONLY_COMMANDS = frozenset({
+    'ls', 'pwd', 'df', 'du', 'cat', 'head', 'tail', 'wc', 'grep', 'which', 'whoami',
+    'uname', 'date', 'uptime', 'ps', 'stat', 'file', 'sw_vers', 'echo',
+})
+# Redirection, chaining, pipes and substitution can turn a read into a write or run other commands
+_SHELL_CONTROL_CHARS = frozenset('><|;&`$')
+
+# System prompts are built once at import so every call sends byte-identical text
+_PLAN_CAPABILITIES = """\
+CAPABILITIES:
+You can generate plans with commands that:
+1. Execute shell commands (ls, grep, find, etc.)
+2. Open applications (using 'open -a AppName')
+3. Manipulate files and directories
+4. Check system information
+5. Work with standard macOS utilities
+"""
+
+_GEN_SYSTEM_PROMPT = """\
+You are MacAssistant, an AI that generates executable plans for macOS tasks.
+
+""" + _PLAN_CAPABILITIES + """
+INSTRUCTIONS:
+Given a task request, provide a plan as a single JSON object.
+The JSON object should have a key "plan" which is a list of step objects.
+Each step object must contain:
+- "number" (int): The step number.
+- "description" (str): The human-readable description of the step.
+- "command" (str, optional): The executable macOS command. Omit or set to null if not applicable (e.g., for observation steps).
+- "is_risky" (bool): True if the step involves a risky operation (e.g., deleting files, modifying system settings).
+- "is_observe" (bool): True if the step requires human observation or input.
+
+EXAMPLE JSON RESPONSE:
+{
+  "plan": [
+    {
+      "number": 1,
+      "description": "Check available disk space",
+      "command": "df -h",
+      "is_risky": false,
+      "is_observe": false
+    },
+    {
+      "number": 2,
+      "description": "Create a new directory for backup files",
+      "command": "mkdir -p ~/backups",
+      "is_risky": false,
+      "is_observe": false
+    },
+    {
+      "number": 3,
+      "description": "Remove old temporary files",
+      "command": "rm -rf ~/tmp/*",
+      "is_risky": true,
+      "is_observe": false
+    },
+    {
+      "number": 4,
+      "description": "Verify the backup appears in Finder",
+      "command": "open ~/backups",
+      "is_risky": false,
+      "is_observe": true
+    }
+  ]
+}
+"""
+
+_REVISE_SYSTEM_PROMPT = """\
+You are MacAssistant, an AI that revises executable plans for macOS tasks based on feedback and results.
+
+""" + _PLAN_CAPABILITIES + """
+INSTRUCTIONS:
+Given the original plan, execution results, and feedback:
+1. Analyze what went wrong or needs improvement.
+2. Create a REVISED plan as a single JSON object.
+3. The JSON object must have a "revision_summary" (str) key explaining the changes,
+   and a "plan" key, which is a list of step objects.
+4. Each step object must contain:
+   - "number" (int): The step number.
+   - "description" (str): The human-readable description of the step.
+   - "command" (str, optional): The executable macOS command. Omit or set to null if not applicable.
+   - "is_risky" (bool): True if the step involves a risky operation.
+   - "is_observe" (bool): True if the step requires human observation.
+
+EXAMPLE JSON RESPONSE:
+{
+  "revision_summary": "The previous command for listing files was incorrect. This version uses 'ls -la'.",
+  "plan": [
+    {
+      "number": 1,
+      "description": "List files in the current directory with details.",
+      "command": "ls -la",
+      "is_risky": false,
+      "is_observe": false
+    },
+    {
+      "number": 2,
+      "description": "Verify the output.",
+      "command": null,
+      "is_risky": false,
+      "is_observe": true
+    }
+  ]
+}
+"""
+
+_REVISE_FAILED_SYSTEM_PROMPT = """\
+You are MacAssistant, an AI that revises executable plans for macOS tasks when a step fails.
+
+""" + _PLAN_CAPABILITIES + """
+INSTRUCTIONS:
+Given the original plan and the failed step details:
+1. Analyze the error and determine what went wrong.
+2. Create a REVISED plan as a single JSON object that addresses the failure.
+3. The JSON object must have a "revision_summary" (str) key explaining the changes,
+   and a "plan" key, which is a list of step objects.
+4. You can modify the failed step, add more steps before/after it, or completely change the approach.
+5. Each step object must contain:
+   - "number" (int): The step number.
+   - "description" (str): The human-readable description of the step.
+   - "command" (str, optional): The executable macOS command. Omit or set to null if not applicable.
+   - "is_risky" (bool): True if the step involves a risky operation.
+   - "is_observe" (bool): True if the step requires human observation.
+6. Ensure the "revision_summary" clearly explains the reasoning for the changes.
+
+EXAMPLE JSON RESPONSE:
+{
+  "revision_summary": "The 'mkdir' command failed because the directory already existed. Added a check first.",
+  "plan": [
+    {
+      "number": 1,
+      "description": "Check if directory '~/test_dir' exists",
+      "command": "test -d ~/test_dir",
+      "is_risky": false,
+      "is_observe": false
+    },
+    {
+      "number": 2,
+      "description": "Create directory '~/test_dir' only if it doesn't exist",
+      "command": "if [ $? -ne 0 ]; then mkdir ~/test_dir; fi",
+      "is_risky": false,
+      "is_observe": false
+    }
+  ]
+}
+"""
+
+_VERIFY_SYSTEM_PROMPT = """\
+You are MacAssistant's verification system. Your job is to analyze command execution results
+and determine if the command achieved its intended purpose.
+
+INSTRUCTIONS:
+1. Analyze the step description, command, stdout, stderr, and return code
+2. Determine if the command succeeded in achieving its purpose
+3. Provide a brief explanation of your reasoning
+4. If the command failed or produced unexpected results, suggest a potential fix
+
+FORMAT YOUR RESPONSE AS JSON:
+{
+    "success": true/false,
+    "explanation": "Brief explanation of result analysis",
+    "suggestion": "Suggested fix or next steps if needed, otherwise empty"
+}
+"""
+
+_SUMMARIZE_SYSTEM_PROMPT = """\
+You are a summarization assistant. Given the history of executed steps and the remaining steps,
+provide two things: 
+1) A short summary of what has been done so far.
+2) Updated or revised steps for the remaining plan if needed.
+
+Return JSON with keys "summary" and "updated_steps".
+"updated_steps" can be an array of step objects like:
+[
+{
+    "number": 3,
+    "description": "New desc",
+    "command": "ls -la"
+},
+...
+]
+If no changes are needed to the next steps, just repeat them.
+"""
+
+
+_MISSING = object()  # Sentinel so cached falsy values aren't mistaken for misses
+
+
+def clip_output(text, max_chars):
+    """
+    Bound command output sent to the LLM to max_chars, keeping its head and tail.
+    
+    The result never exceeds max_chars, so clipping already clipped output is a no-op.
+    
+    Args:
+        text (str): stdout or stderr of a command
+        max_chars (int): Maximum length of the returned text (LLM_OUTPUT_SLICE)
+        
+    Returns:
+        str: The text unchanged if it fits, otherwise its head and tail around an elision
+             marker; only the tail when max_chars is too small to hold the marker
+    """
+    if not text or len(text) <= max_chars:
+        return text
+    # Size the marker for the largest possible count so the result always fits
+    kept = max_chars - len(f"\n...[{len(text)} chars elided]...\n")
+    if kept < 2:
+        # Slice from an explicit start: text[-0:] would be the whole string
+        return text[len(text) - max(0, max_chars):]
+    head = (kept + 1) // 2
+    tail = kept - head
+    return f"{text[:head]}\n...[{len(text) - kept} chars elided]...\n{text[-tail:]}"
 
 
 class LRUCache:
     """
-    A simple Least Recently Used (LRU) Cache implementation using collections.OrderedDict.
+    A simple Least Recently Used (LRU) Cache implementation on top of an insertion-ordered dict.
     """
     def __init__(self, max_size=128):
-        self.cache = OrderedDict()
+        self.cache = {}
         self.max_size = max_size
+        # Caches are shared by concurrent request handlers and LLM calls, so updates are serialized
+        self._lock = threading.Lock()
 
     def get(self, key):
         """
         Retrieves an item from the cache. Marks it as recently used.
         Returns the item if key exists, otherwise None.
         """
-        if key not in self.cache:
-            return None
-        # Move the accessed item to the end to mark it as recently used
-        self.cache.move_to_end(key)
-        return self.cache[key]
+        with self._lock:
+            value = self.cache.pop(key, _MISSING)
+            if value is _MISSING:
+                return None
+            # Re-insert the accessed item at the end to mark it as recently used
+            self.cache[key] = value
+            return value
 
     def put(self, key, value):
         """
         Adds an item to the cache. If the cache is full, evicts the least recently used item.
         """
-        if key in self.cache:
-            # Move existing item to end if it's updated, to mark as recently used
-            self.cache.move_to_end(key)
-        self.cache[key] = value
-        if len(self.cache) > self.max_size:
-            # Pop the first item (least recently used)
-            self.cache.popitem(last=False)
+        with self._lock:
+            # Drop any existing entry so the update lands at the end as most recently used
+            self.cache.pop(key, None)
+            self.cache[key] = value
+            if len(self.cache) > self.max_size:
+                # Pop the first item (least recently used)
+                del self.cache[next(iter(self.cache))]
+
+    def pop(self, key):
+        """
+        Removes an item from the cache.
+        Returns the removed item if key existed, otherwise None.
+        """
+        with self._lock:
+            return self.cache.pop(key, None)
 
     def __contains__(self, key):
         """
@@ -108,17 +306,48 @@ class LLMIntegration:
         if not self.api_key:
             raise ValueError("Missing GEMINI_API_KEY in configuration.")
 
+        # google.genai is imported here rather than at module level, so importing this module
+        # (e.g. for LRUCache) doesn't pull in the SDK.
+        from google import genai
+        from google.genai import errors, types
+        self._genai_types = types
+        self._genai_errors = errors
+        self._generation_configs = {}
+        # One client for the lifetime of the integration so its HTTP session (and TLS connection) is reused
+        self._client = genai.Client(api_key=self.api_key)
+
+        # Max chars of each stdout/stderr embedded in a prompt; chatty commands would otherwise blow up token cost
+        self.output_slice = getattr(active_config, 'LLM_OUTPUT_SLICE', 2048)
+
+        # Rate-limited and server-side failures are retried with exponential backoff and jitter
+        # A negative value would skip the attempt loop entirely, so it means "no retries"
+        self.max_retries = max(0, getattr(active_config, 'LLM_MAX_RETRIES', 2))
+        self.retry_backoff = getattr(active_config, 'LLM_RETRY_BACKOFF', 1.0)
+
         # Initialize ThreadPoolExecutor
         # The number of workers can be made configurable, e.g., via active_config.LLM_MAX_WORKERS
         self.executor = ThreadPoolExecutor(max_workers=getattr(active_config, 'LLM_MAX_WORKERS', 4))
         logger.info(f"Initialized ThreadPoolExecutor with max_workers={self.executor._max_workers} for LLMIntegration")
         
+        # A single background writer persists plans in submission order, keeping disk I/O off the request path
+        self._disk_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='plan-writer')
+        
         # Initialize LRU cache for plans
         # Default to 128 if PLAN_CACHE_SIZE is not in config, though it should be.
         cache_size = getattr(active_config, 'PLAN_CACHE_SIZE', 128) 
         self.plans_cache = LRUCache(max_size=cache_size)
         logger.info(f"Initialized LRU plan cache with max size: {cache_size}")
         
+        # Raw LLM plan responses keyed by user request, so repeating a request skips the API call.
+        # Responses (not parsed plans) are cached so every hit is parsed into fresh step dicts.
+        self.plan_response_cache = LRUCache(max_size=getattr(active_config, 'PLAN_RESPONSE_CACHE_SIZE', 64))
+        # Cache key each cached plan was generated from, so a rejected plan's response can be dropped
+        self.plan_request_keys = LRUCache(max_size=getattr(active_config, 'PLAN_RESPONSE_CACHE_SIZE', 64))
+        
+        # Raw Gemini responses keyed by a digest of (model, system prompt, user message), so an
+        # identical verification or summary request is answered without another round-trip.
+        self.response_cache = LRUCache(max_size=getattr(active_config, 'LLM_RESPONSE_CACHE_SIZE', 256))
+        
         # Create or use plans directory for persistent storage
         self.plans_dir = os.path.join(active_config.LOG_DIR, 'plans')
         os.makedirs(self.plans_dir, exist_ok=True)
@@ -135,76 +364,48 @@ class LLMIntegration:
             dict: A plan containing a list of sub-tasks with commands
         """
         # System prompt to instruct the LLM
-        system_prompt = """
-        You are MacAssistant, an AI that generates executable plans for macOS tasks.
-
-        CAPABILITIES:
-        You can generate plans with commands that:
-        1. Execute shell commands (ls, grep, find, etc.)
-        2. Open applications (using 'open -a AppName')
-        3. Manipulate files and directories
-        4. Check system information
-        5. Work with standard macOS utilities
-
-        INSTRUCTIONS:
-        Given a task request, provide a plan as a single JSON object.
-        The JSON object should have a key "plan" which is a list of step objects.
-        Each step object must contain:
-        - "number" (int): The step number.
-        - "description" (str): The human-readable description of the step.
-        - "command" (str, optional): The executable macOS command. Omit or set to null if not applicable (e.g., for observation steps).
-        - "is_risky" (bool): True if the step involves a risky operation (e.g., deleting files, modifying system settings).
-        - "is_observe" (bool): True if the step requires human observation or input.
-
-        EXAMPLE JSON RESPONSE:
-        {
-          "plan": [
-            {
-              "number": 1,
-              "description": "Check available disk space",
-              "command": "df -h",
-              "is_risky": false,
-              "is_observe": false
-            },
-            {
-              "number": 2,
-              "description": "Create a new directory for backup files",
-              "command": "mkdir -p ~/backups",
-              "is_risky": false,
-              "is_observe": false
-            },
-            {
-              "number": 3,
-              "description": "Remove old temporary files",
-              "command": "rm -rf ~/tmp/*",
-              "is_risky": true,
-              "is_observe": false
-            },
-            {
-              "number": 4,
-              "description": "Verify the backup appears in Finder",
-              "command": "open ~/backups",
-              "is_risky": false,
-              "is_observe": true
-            }
-          ]
-        }
-        """
+        system_prompt = _GEN_SYSTEM_PROMPT
         
-        # Send request to Gemini
-        response_text = self._call_gemini_api(system_prompt, user_request)
+        # Send request to Gemini, unless the same request was already answered.
+        # Time-sensitive requests ("what is running now") always get a fresh plan.
+        cache_key = user_request.strip()
+        cacheable = not _TIME_SENSITIVE_RE.search(cache_key)
+        response_text = self.plan_response_cache.get(cache_key) if cacheable else None
+        if response_text is not None:
+            logger.info("Plan response cache hit for user request")
+        else:
+            # Bypass the generic response cache: plan_response_cache only keeps responses that parsed
+            response_text = self._call_gemini_api(system_prompt, user_request, use_cache=False)
         
         # Parse the response to extract the plan with commands
         plan_data = self._parse_plan_with_commands(response_text) 
         
-        if 'error' in plan_data:
-            logger.error(f"Failed to generate plan: {plan_data['error']}")
-            return {'id': None, 'steps': [], 'status': 'error', 'error': plan_data['error']}
+        if plan_data.get('status') == 'error':
+            error = plan_data.get('message', 'Unknown parsing error')
+            logger.error(f"Failed to generate plan: {error}")
+            return {'id': None, 'steps': [], 'status': 'error', 'error': error, 'error_code': plan_data.get('error_code')}
+
+        # Only responses that parsed into a plan are worth replaying
+        if cacheable:
+            self.plan_response_cache.put(cache_key, response_text)
+            self.plan_request_keys.put(plan_data['id'], cache_key)
 
         self._store_plan(plan_data)
         
         return plan_data
     
+    def forget_plan_response(self, plan_id):
+        """
+        Drop the cached LLM response a plan was generated from, so asking again gets a new plan.
+        
+        Args:
+            plan_id (str): The ID of the rejected or revised plan
+        """
+        cache_key = self.plan_request_keys.pop(plan_id)
+        if cache_key is not None:
+            self.plan_response_cache.pop(cache_key)
+            logger.info(f"Dropped cached plan response for plan {plan_id}")
+    
     def revise_plan(self, plan_id, feedback, step_results=None):
         """
         Revise a plan based on user feedback or execution results.
@@ -224,95 +425,78 @@ class LLMIntegration:
             
         logger.info(f"Revising plan {plan_id} based on feedback")
         
+        # A plan that needs revising should not be replayed for the same request
+        self.forget_plan_response(plan_id)
+        
         # System prompt for plan revision
-        system_prompt = """
-        You are MacAssistant, an AI that revises executable plans for macOS tasks based on feedback and results.
-
-        CAPABILITIES:
-        You can generate plans with commands that:
-        1. Execute shell commands (ls, grep, find, etc.)
-        2. Open applications (using 'open -a AppName')
-        3. Manipulate files and directories
-        4. Check system information
-        5. Work with standard macOS utilities
-
-        INSTRUCTIONS:
-        Given the original plan, execution results, and feedback:
-        1. Analyze what went wrong or needs improvement.
-        2. Create a REVISED plan as a single JSON object.
-        3. The JSON object must have a "revision_summary" (str) key explaining the changes,
-           and a "plan" key, which is a list of step objects.
-        4. Each step object must contain:
-           - "number" (int): The step number.
-           - "description" (str): The human-readable description of the step.
-           - "command" (str, optional): The executable macOS command. Omit or set to null if not applicable.
-           - "is_risky" (bool): True if the step involves a risky operation.
-           - "is_observe" (bool): True if the step requires human observation.
-
-        EXAMPLE JSON RESPONSE:
-        {
-          "revision_summary": "The previous command for listing files was incorrect. This version uses 'ls -la'.",
-          "plan": [
-            {
-              "number": 1,
-              "description": "List files in the current directory with details.",
-              "command": "ls -la",
-              "is_risky": false,
-              "is_observe": false
-            },
-            {
-              "number": 2,
-              "description": "Verify the output.",
-              "command": null,
-              "is_risky": false,
-              "is_observe": true
-            }
-          ]
-        }
-        """
+        system_prompt = _REVISE_SYSTEM_PROMPT
         
         # Build a detailed user message with plan and results
-        user_message = f"ORIGINAL PLAN:\n"
+        # Collect the message in parts and join once; repeated += would recopy the whole prompt per step
+        parts = ["ORIGINAL PLAN:\n"]
         
         # Format original plan steps with command and any results
         for step in original_plan['steps']:
             status_info = ""
-            if step_results and str(step['number']) in step_results:
-                result = step_results[str(step['number'])]
-                if result.get('stdout'):
-                    status_info += f"\nSTDOUT: {result['stdout']}"
-                if result.get('stderr'):
-                    status_info += f"\nSTDERR: {result['stderr']}"
-                if result.get('status'):
-                    status_info += f"\nSTATUS: {result['status']}"
+            # step_results keys are strings: the plan round-trips through JSON, which only has string keys
+            result = step_results.get(str(step['number'])) if step_results else None
+            if result:
+                status_info = "".join(
+                    f"\n{label}: {self._clip_output(result[key])}"
+                    for key, label in (('stdout', 'STDOUT'), ('stderr', 'STDERR'), ('status', 'STATUS'))
+                    if result.get(key)
+                )
                     
-            user_message += f"{step['number']}. {step['description']}\n"
+            parts.append(f"{step['number']}. {step['description']}\n")
             if 'command' in step and step['command']:
-                user_message += f"COMMAND: {step['command']}\n"
+                parts.append(f"COMMAND: {step['command']}\n")
             if status_info:
-                user_message += f"RESULT: {status_info}\n"
-            user_message += "\n"
+                parts.append(f"RESULT: {status_info}\n")
+            parts.append("\n")
         
-        user_message += f"FEEDBACK OR ERROR:\n{feedback}\n\nPlease revise the plan based on this feedback and execution results."
+        parts.append(f"FEEDBACK OR ERROR:\n{feedback}\n\nPlease revise the plan based on this feedback and execution results.")
+        user_message = "".join(parts)
         
-        # Send request to Gemini
-        response_text = self._call_gemini_api(system_prompt, user_message)
+        # Send request to Gemini; a user asking again for a revision wants a fresh answer, not a replay
+        response_text = self._call_gemini_api(system_prompt, user_message, use_cache=False)
         logger.info(f"Revised plan response: {response_text}")
         
         # Parse the response to extract the revised plan
         parsed_data = self._parse_plan_with_commands(response_text, is_revision=True)
 
-        if 'error' in parsed_data:
-            logger.error(f"Failed to revise plan: {parsed_data['error']}")
-            return {'id': None, 'steps': [], 'status': 'error', 'error': parsed_data['error'], 'revision_summary': ''}
+        if parsed_data.get('status') == 'error':
+            error = parsed_data.get('message', 'Unknown parsing error')
+            logger.error(f"Failed to revise plan: {error}")
+            return {'id': None, 'steps': [], 'status': 'error', 'error': error, 'error_code': parsed_data.get('error_code'), 'revision_summary': ''}
         
         self._store_plan(parsed_data, is_revision=True, original_plan_id=plan_id)
         
         return parsed_data
     
-    async def async_call_gemini(self, system_prompt, user_message):
+    def _generation_config(self, system_prompt):
+        """
+        Get the generation config carrying a system prompt, building it once per prompt.
+        
+        Args:
+            system_prompt (str): One of the module-level system prompts
+            
+        Returns:
+            types.GenerateContentConfig: Config with the prompt as system_instruction and JSON output
+        """
+        config = self._generation_configs.get(system_prompt)
+        if config is None:
+            # Every system prompt asks for a JSON object, so JSON response mode keeps replies free of
+            # markdown fences and prose that would otherwise have to be scraped off
+            config = self._genai_types.GenerateContentConfig(
+                system_instruction=system_prompt,
+                response_mime_type='application/json',
+            )
+            self._generation_configs[system_prompt] = config
+        return config
+
+    def _call_gemini_sync(self, system_prompt, user_message):
         """
-        Call the Gemini API with the given prompts.
+        Call the Gemini API with the given prompts, blocking until the response arrives.
         
         Args:
             system_prompt (str): The system prompt
@@ -322,45 +506,77 @@ class LLMIntegration:
             str: The response from the API
         """
         try:
-            # Combine system prompt and user message for Gemini
-            # Gemini doesn't have distinct system/user roles like OpenAI
-            combined_prompt = f"{system_prompt}\n\nUser request: {user_message}"
-            
             logger.info(f"Sending prompt to Gemini model: {self.model}")
 
-            client = genai.Client(api_key=self.api_key)  # Updated for generativeai
-
-            response = client.models.generate_content(
-            model=self.model,
-            contents=[types.Part.from_text(text=combined_prompt)],
-        )
-            
-            # Return raw response text
-            return response.text
+            for attempt in range(self.max_retries + 1):
+                try:
+                    # The static system prompt goes in system_instruction and only the per-call message in
+                    # contents, so every request starts with the same byte-identical prefix.
+                    response = self._client.models.generate_content(
+                        model=self.model,
+                        contents=[self._genai_types.Part.from_text(text=user_message)],
+                        config=self._generation_config(system_prompt),
+                    )
+                    
+                    # Return raw response text
+                    return response.text
+                except self._genai_errors.APIError as e:
+                    retryable = e.code == 429 or (e.code or 0) >= 500
+                    if not retryable or attempt == self.max_retries:
+                        raise
+                    delay = self.retry_backoff * (2 ** attempt) + random.uniform(0, self.retry_backoff)
+                    logger.warning(f"Gemini call failed with {e.code} (attempt {attempt + 1}/{self.max_retries + 1}); retrying in {delay:.1f}s")
+                    time.sleep(delay)
             
         except Exception as e:
             logger.exception(f"Error calling Gemini model: {e}")
             raise Exception(f"API request failed: {str(e)}")
         
-    def _call_gemini_api(self, system_prompt, user_message):
+    def _response_cache_key(self, system_prompt, user_message):
+        """Digest of everything that determines a Gemini response, used as the response cache key."""
+        digest = hashlib.blake2b(digest_size=16)
+        for part in (self.model, system_prompt, user_message):
+            digest.update(part.encode('utf-8'))
+            digest.update(b'\x00')
+        return digest.hexdigest()
+
+    def _cache_response(self, system_prompt, user_message, response_text):
+        """
+        Remember a response that parsed successfully, so an identical request can reuse it.
+        
+        Args:
+            system_prompt (str): The system prompt the response was generated for
+            user_message (str): The user message the response was generated for
+            response_text (str): The response text
+        """
+        self.response_cache.put(self._response_cache_key(system_prompt, user_message), response_text)
+
+    def _call_gemini_api(self, system_prompt, user_message, use_cache=True):
         """
         Call the Gemini API with the given prompts synchronously.
         
         Args:
             system_prompt (str): The system prompt
             user_message (str): The user message
+            use_cache (bool): Whether an identical earlier request may be answered from the response cache;
+                responses only enter the cache through _cache_response, once the caller has parsed them
             
         Returns:
             str: The response from the API
         """
-        # Use the global event loop defined at module level, but run it in the executor.
-        # This isolates the event loop's execution from the main Flask thread,
-        # aiming to prevent Kqueue conflicts on macOS and improve concurrency.
-        future = self.executor.submit(global_loop.run_until_complete, self.async_call_gemini(system_prompt, user_message))
+        if use_cache:
+            cached_response = self.response_cache.get(self._response_cache_key(system_prompt, user_message))
+            if cached_response is not None:
+                logger.info("Gemini response cache hit")
+                return cached_response
+
+        # generate_content is a blocking call, so it runs directly in a worker thread;
+        # the executor only exists to bound the wait with LLM_TIMEOUT.
+        future = self.executor.submit(self._call_gemini_sync, system_prompt, user_message)
         try:
             # Configurable timeout for the LLM call.
             timeout = getattr(active_config, 'LLM_TIMEOUT', 60) 
-            return future.result(timeout=timeout) 
+            return future.result(timeout=timeout)
         except TimeoutError as e:
             logger.error(f"Timeout waiting for Gemini API call ({timeout}s): {e}")
             # Upstream code should be prepared to handle this.
@@ -385,32 +601,24 @@ class LLMIntegration:
         Returns:
             dict: Analysis result containing success evaluation and explanation
         """
+        if success and not stderr and self._is_read_only_command(command):
+            # A read-only command that exited cleanly with nothing on stderr did what it was asked to
+            return {
+                "success": True,
+                "explanation": "Read-only command exited with status 0 and no error output; LLM verification skipped.",
+                "suggestion": ""
+            }
+
         # System prompt for verification
-        system_prompt = """
-        You are MacAssistant's verification system. Your job is to analyze command execution results
-        and determine if the command achieved its intended purpose.
-        
-        INSTRUCTIONS:
-        1. Analyze the step description, command, stdout, stderr, and return code
-        2. Determine if the command succeeded in achieving its purpose
-        3. Provide a brief explanation of your reasoning
-        4. If the command failed or produced unexpected results, suggest a potential fix
-        
-        FORMAT YOUR RESPONSE AS JSON:
-        {
-            "success": true/false,
-            "explanation": "Brief explanation of result analysis",
-            "suggestion": "Suggested fix or next steps if needed, otherwise empty"
-        }
-        """
+        system_prompt = _VERIFY_SYSTEM_PROMPT
         
         # Build the user message with execution details
         user_message = f"""
         STEP DESCRIPTION: {step_description}
         EXECUTED COMMAND: {command}
         RETURN CODE: {'0 (Success)' if success else 'Non-zero (Failure)'}
-        STDOUT: {stdout if stdout else '(No output)'}
-        STDERR: {stderr if stderr else '(No error output)'}
+        STDOUT: {self._clip_output(stdout) if stdout else '(No output)'}
+        STDERR: {self._clip_output(stderr) if stderr else '(No error output)'}
         
         Please analyze these results and determine if the command successfully achieved its purpose.
         Return your analysis in the required JSON format.
@@ -424,15 +632,7 @@ class LLMIntegration:
 
         try:
             # Attempt to find JSON block if LLM wraps it in markdown or directly
-            json_str = None
-            match_markdown = re.search(r'```json\s*([\s\S]*?)\s*```', response)
-            if match_markdown:
-                json_str = match_markdown.group(1)
-            else:
-                # Fallback: try to find JSON object directly if no markdown block
-                match_direct_json = re.search(r'{\s*".*?":[\s\S]*}', response)
-                if match_direct_json:
-                    json_str = match_direct_json.group(0)
+            json_str = self._extract_json_str(response)
             
             if not json_str:
                 logger.error(f"No JSON block found in LLM verification response. Snippet: {raw_response_snippet}")
@@ -470,6 +670,7 @@ class LLMIntegration:
             if 'suggestion' not in parsed_json:
                 parsed_json['suggestion'] = "" # Default to empty string if missing
 
+            self._cache_response(system_prompt, user_message, response)
             return parsed_json # Contains success, explanation, suggestion
                 
         except Exception as e: # Catch-all for unexpected errors during parsing logic
@@ -481,6 +682,143 @@ class LLMIntegration:
                 "error_code": "UNKNOWN_PARSING_ERROR"
             }
     
+    def _clip_output(self, text):
+        """
+        Bound command output before it is embedded in a prompt.
+        
+        Args:
+            text (str): stdout or stderr of a command
+            
+        Returns:
+            str: The text clipped to LLM_OUTPUT_SLICE chars by clip_output
+        """
+        return clip_output(text, self.output_slice)
+
+    @staticmethod
+    def _is_read_only_command(command):
+        """
+        Check whether a command is a single invocation of a known read-only utility.
+        
+        Args:
+            command (str): The executed command
+            
+        Returns:
+            bool: True if the command cannot have modified anything
+        """
+        if not command or any(char in _SHELL_CONTROL_CHARS for char in command):
+            return False
+        try:
+            args = shlex.split(command)
+        except ValueError:
+            return False
+        return bool(args) and args[0] in _READ_ONLY_COMMANDS
+
+    @staticmethod
+    def _extract_json_str(response_text):
+        """
+        Find the JSON object text in an LLM response.
+        
+        Args:
+            response_text (str): The raw LLM response
+            
+        Returns:
+            str: The JSON text, or None if the response contains no recognizable JSON object
+        """
+        stripped_response = response_text.strip()
+        if stripped_response.startswith('{') and stripped_response.endswith('}') and '```' not in stripped_response:
+            # Bare JSON object (the usual case in JSON response mode): no regex scan needed
+            return stripped_response
+        # Attempt to find JSON block if LLM wraps it in markdown
+        match_markdown = _JSON_FENCE_RE.search(response_text)
+        if match_markdown:
+            return match_markdown.group(1)
+        # Fallback: try to find JSON object directly if no markdown block
+        return LLMIntegration._find_json_object(response_text)
+
+    @staticmethod
+    def _find_json_object(text):
+        """
+        Find the first balanced, keyed JSON object (``{"key": ...}``) embedded in text.
+        
+        Scans forward tracking brace depth and string/escape state, so the cost is linear
+        in the length of the object and braces inside string values or trailing prose
+        don't affect the result.
+        
+        Args:
+            text (str): Text that may contain a JSON object
+            
+        Returns:
+            str: The object text, or None if no keyed object closes in the text
+        """
+        start = text.find('{')
+        while start != -1:
+            # Only objects whose first token is a key qualify; skip prose like "{braces}"
+            if _JSON_KEY_START_RE.match(text, start + 1):
+                depth = 0
+                in_string = False
+                escaped = False
+                for end in range(start, len(text)):
+                    char = text[end]
+                    if in_string:
+                        if escaped:
+                            escaped = False
+                        elif char == '\\':
+                            escaped = True
+                        elif char == '"':
+                            in_string = False
+                    elif char == '"':
+                        in_string = True
+                    elif char == '{':
+                        depth += 1
+                    elif char == '}':
+                        depth -= 1
+                        if depth == 0:
+                            return text[start:end + 1]
+                # Unbalanced through the end of the text (e.g. a truncated response)
+                return None
+            start = text.find('{', start + 1)
+        return None
+
+    @staticmethod
+    def _plan_id(steps):
+        """
+        Compute a stable, content-addressed plan ID from the plan's steps.
+        
+        Args:
+            steps (list): Internal step dicts.
+            
+        Returns:
+            str: Hex digest that is identical across processes for identical steps.
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        for step in steps:
+            digest.update(
+                f"{step.get('number')}\x1f{step.get('description')}\x1f{step.get('command')}\x1f"
+                f"{int(bool(step.get('is_risky')))}\x1f{int(bool(step.get('is_observe')))}\x1e".encode('utf-8')
+            )
+        return digest.hexdigest()
+
+    @staticmethod
+    def _clean_command(command):
+        """
+        Normalize a step's command as returned by the LLM.
+        
+        Args:
+            command: The raw "command" value from a plan step
+            
+        Returns:
+            str: The stripped command with any wrapping backticks removed ("" for a missing command),
+                or None if the value is not a string
+        """
+        if command is None:
+            return "" # Standardize to empty string if command is None
+        if not isinstance(command, str):
+            return None
+        command = command.strip()
+        if len(command) > 1 and command.startswith('`') and command.endswith('`'): # Avoid stripping if command is just '`'
+            command = command[1:-1].strip()
+        return command
+
     def _parse_plan_with_commands(self, response_text, is_revision=False):
         """
         Parse the LLM JSON response to extract the plan with commands.
@@ -494,19 +832,22 @@ class LLMIntegration:
         """
         raw_response_snippet = response_text[:200] # For logging
 
+        if '"plan"' not in response_text:
+            # Every valid plan has a "plan" key; skip the extraction and JSON passes for text that can't be one
+            logger.error(f"Invalid plan format: 'plan' key is missing. Snippet: {raw_response_snippet}")
+            return {
+                'id': None,
+                'error_code': 'VALIDATION_FAILED',
+                'message': "Invalid plan format: 'plan' key is missing or not a list.",
+                'raw_response_snippet': raw_response_snippet,
+                'steps': [],
+                'status': 'error'
+            }
+
         try:
-            # Attempt to find JSON block if LLM wraps it in markdown
-            match_markdown = re.search(r'```json\s*([\s\S]*?)\s*```', response_text)
-            if match_markdown:
-                json_str = match_markdown.group(1)
-            else:
-                # Fallback: try to find JSON object directly if no markdown block
-                # This is a more general regex for a JSON object
-                match_direct_json = re.search(r'{\s*".*?":[\s\S]*}', response_text)
-                if match_direct_json:
-                    json_str = match_direct_json.group(0)
-                else:
-                    json_str = response_text # Assume the whole response is JSON if no specific block found
+            json_str = self._extract_json_str(response_text)
+            if json_str is None:
+                json_str = response_text # Assume the whole response is JSON if no specific block found
 
             try:
                 parsed_json = json.loads(json_str)
@@ -574,10 +915,7 @@ class LLMIntegration:
                     # Depending on strictness, you might want to return an error here
                     continue 
 
-                # Validate essential keys
-                essential_keys = ['number', 'description', 'command', 'is_risky', 'is_observe']
-                missing_keys = [key for key in essential_keys if key not in step_data]
-                if any(key not in step_data for key in ['number', 'description']): # number and description are critical
+                if 'number' not in step_data or 'description' not in step_data: # number and description are critical
                     logger.error(f"Invalid step structure at index {i}: Missing critical keys ('number', 'description'). Step data: {step_data}. Snippet: {raw_response_snippet}")
                     return {
                         'id': None,
@@ -588,28 +926,22 @@ class LLMIntegration:
                         'status': 'error'
                     }
 
-                command = step_data.get('command') # Allow command to be None or empty string
-                if command and isinstance(command, str):
-                    command = command.strip()
-                    if command.startswith('`') and command.endswith('`') and len(command) > 1: # Avoid stripping if command is just '`'
-                        command = command[1:-1].strip()
-                elif command is None: 
-                    command = "" # Standardize to empty string if command is None
-                elif not isinstance(command, str): # Command must be string or None
-                    logger.warning(f"Invalid command type for step {step_data.get('number', i)}: {type(command)}. Setting to empty. Snippet: {raw_response_snippet}")
+                command = self._clean_command(step_data.get('command'))
+                if command is None: # Command must be string or None
+                    logger.warning(f"Invalid command type for step {step_data['number']}: {type(step_data['command'])}. Setting to empty. Snippet: {raw_response_snippet}")
                     command = ""
 
-
                 internal_steps.append({
-                    'number': step_data.get('number'),
-                    'description': step_data.get('description', 'No description provided.'),
+                    'number': step_data['number'],
+                    'description': step_data['description'],
                     'command': command,
-                    'is_risky': step_data.get('is_risky', False) if isinstance(step_data.get('is_risky'), bool) else False,
-                    'is_observe': step_data.get('is_observe', False) if isinstance(step_data.get('is_observe'), bool) else False,
+                    # Only a literal JSON true sets the flags; anything else is treated as false
+                    'is_risky': step_data.get('is_risky') is True,
+                    'is_observe': step_data.get('is_observe') is True,
                     'status': 'pending'
                 })
             
-            plan_id = str(hash(json.dumps(internal_steps))) 
+            plan_id = self._plan_id(internal_steps)
 
             plan_output = {
                 'id': plan_id,
@@ -618,9 +950,9 @@ class LLMIntegration:
             }
 
             if is_revision:
-                revision_summary = parsed_json.get('revision_summary', '')
+                revision_summary = parsed_json.get('revision_summary')
                 if not isinstance(revision_summary, str):
-                    logger.warning(f"Revision summary is not a string. Defaulting to empty. Snippet: {raw_response_snippet}")
+                    logger.warning(f"Revision summary is missing or not a string. Using placeholder. Snippet: {raw_response_snippet}")
                     revision_summary = 'Revision summary was not a string or was missing.'
                 plan_output['revision_summary'] = revision_summary
             
@@ -679,56 +1011,10 @@ class LLMIntegration:
         failed_step = original_plan['steps'][failed_step_index]
         
         # System prompt for plan revision after step failure
-        system_prompt = """
-        You are MacAssistant, an AI that revises executable plans for macOS tasks when a step fails.
-
-        CAPABILITIES:
-        You can generate plans with commands that:
-        1. Execute shell commands (ls, grep, find, etc.)
-        2. Open applications (using 'open -a AppName')
-        3. Manipulate files and directories
-        4. Check system information
-        5. Work with standard macOS utilities
-
-        INSTRUCTIONS:
-        Given the original plan and the failed step details:
-        1. Analyze the error and determine what went wrong.
-        2. Create a REVISED plan as a single JSON object that addresses the failure.
-        3. The JSON object must have a "revision_summary" (str) key explaining the changes,
-           and a "plan" key, which is a list of step objects.
-        4. You can modify the failed step, add more steps before/after it, or completely change the approach.
-        5. Each step object must contain:
-           - "number" (int): The step number.
-           - "description" (str): The human-readable description of the step.
-           - "command" (str, optional): The executable macOS command. Omit or set to null if not applicable.
-           - "is_risky" (bool): True if the step involves a risky operation.
-           - "is_observe" (bool): True if the step requires human observation.
-        6. Ensure the "revision_summary" clearly explains the reasoning for the changes.
-
-        EXAMPLE JSON RESPONSE:
-        {
-          "revision_summary": "The 'mkdir' command failed because the directory already existed. Added a check first.",
-          "plan": [
-            {
-              "number": 1,
-              "description": "Check if directory '~/test_dir' exists",
-              "command": "test -d ~/test_dir",
-              "is_risky": false,
-              "is_observe": false
-            },
-            {
-              "number": 2,
-              "description": "Create directory '~/test_dir' only if it doesn't exist",
-              "command": "if [ $? -ne 0 ]; then mkdir ~/test_dir; fi",
-              "is_risky": false,
-              "is_observe": false
-            }
-          ]
-        }
-        """
+        system_prompt = _REVISE_FAILED_SYSTEM_PROMPT
         
-        # Build a detailed user message with plan and error details
-        user_message = "ORIGINAL PLAN:\n"
+        # Build a detailed user message with plan and error details, joined once at the end
+        parts = ["ORIGINAL PLAN:\n"]
         
         # Format original plan steps
         for i, step in enumerate(original_plan['steps']):
@@ -736,21 +1022,22 @@ class LLMIntegration:
             if i == failed_step_index:
                 prefix = "FAILED STEP: "
             
-            user_message += f"{prefix}{step['number']}. {step['description']}\n"
+            parts.append(f"{prefix}{step['number']}. {step['description']}\n")
             if 'command' in step and step['command']:
-                user_message += f"COMMAND: {step['command']}\n"
+                parts.append(f"COMMAND: {step['command']}\n")
             
             # Add failure details for the failed step
             if i == failed_step_index:
-                user_message += "FAILURE DETAILS:\n"
+                parts.append("FAILURE DETAILS:\n")
                 if stdout:
-                    user_message += f"STDOUT: {stdout}\n"
+                    parts.append(f"STDOUT: {self._clip_output(stdout)}\n")
                 if stderr:
-                    user_message += f"STDERR: {stderr}\n"
+                    parts.append(f"STDERR: {self._clip_output(stderr)}\n")
             
-            user_message += "\n"
+            parts.append("\n")
         
-        user_message += "Please revise the plan to address the issue with the failed step. The revision should solve the problem and allow the task to be completed successfully."
+        parts.append("Please revise the plan to address the issue with the failed step. The revision should solve the problem and allow the task to be completed successfully.")
+        user_message = "".join(parts)
         
         # Send request to Gemini
         response_text = self._call_gemini_api(system_prompt, user_message)
@@ -759,14 +1046,30 @@ class LLMIntegration:
         # Parse the response to extract the revised plan
         parsed_data = self._parse_plan_with_commands(response_text, is_revision=True)
 
-        if 'error' in parsed_data:
-            logger.error(f"Failed to revise plan after step failure: {parsed_data['error']}")
-            return {'id': None, 'steps': [], 'status': 'error', 'error': parsed_data['error'], 'revision_summary': ''}
+        if parsed_data.get('status') == 'error':
+            error = parsed_data.get('message', 'Unknown parsing error')
+            logger.error(f"Failed to revise plan after step failure: {error}")
+            return {'id': None, 'steps': [], 'status': 'error', 'error': error, 'error_code': parsed_data.get('error_code'), 'revision_summary': ''}
                 
+        self._cache_response(system_prompt, user_message, response_text)
         self._store_plan(parsed_data, is_revision=True, original_plan_id=plan_id)
         
         return parsed_data
         
+    def register_revised_plan(self, plan_data, original_plan_id):
+        """
+        Register a revised plan produced outside revise_plan (e.g. reused from a cache),
+        so get_plan and later revisions can find it.
+        
+        Args:
+            plan_data (dict): The revised plan data
+            original_plan_id (str): The ID of the plan it revises
+            
+        Returns:
+            str: The plan ID or None if plan_data is invalid
+        """
+        return self._store_plan(plan_data, is_revision=True, original_plan_id=original_plan_id)
+
     def _store_plan(self, plan_data, is_revision=False, original_plan_id=None):
         """
         Store a plan both in memory and on disk.
@@ -788,7 +1091,7 @@ class LLMIntegration:
             # This should ideally be set by _parse_plan_with_commands upon successful parse
             logger.error("Plan data is missing an ID during storage.")
             # Fallback, though less ideal as ID should be stable post-parsing
-            plan_id = str(hash(json.dumps(plan_data.get('steps', []))))
+            plan_id = self._plan_id(plan_data.get('steps', []))
             plan_data['id'] = plan_id
         
         if is_revision and original_plan_id:
@@ -803,25 +1106,53 @@ class LLMIntegration:
         logger.info(f"{'Revised p' if is_revision else 'P'}lan stored with ID: {plan_id}. Cache size: {len(self.plans_cache)}")
         return plan_id
     
-    def _save_plan_to_disk(self, plan_id, plan_data):
+    def _save_plan_to_disk(self, plan_id, plan_data, sync=False):
         """
         Save a plan to disk for persistence.
         
+        The plan is serialized on the calling thread, so later in-place updates (step status,
+        results) can't race the write; the file write itself runs on the background writer.
+        
         Args:
             plan_id (str): The ID of the plan
             plan_data (dict): The plan data to save
+            sync (bool): Write before returning instead of on the background writer
         """
+        try:
+            payload = json.dumps(plan_data, separators=(',', ':'))
+        except Exception as e:
+            logger.error(f"Error serializing plan {plan_id} for disk: {e}")
+            return
+        
+        if sync:
+            self._write_plan_file(plan_id, payload)
+        else:
+            self._disk_writer.submit(self._write_plan_file, plan_id, payload)
+    
+    def _write_plan_file(self, plan_id, payload):
+        """
+        Atomically write a serialized plan to the plans directory.
+        
+        Args:
+            plan_id (str): The ID of the plan
+            payload (str): The plan serialized as JSON
+        """
+        temp_path = None
         try:
             plan_path = os.path.join(self.plans_dir, f"{plan_id}.json")
             
-            with tempfile.NamedTemporaryFile('w', delete=False) as temp_file:
-                json.dump(plan_data, temp_file, indent=2) 
+            # Write next to the target so os.replace is a same-filesystem atomic rename, never a copy
+            with tempfile.NamedTemporaryFile('w', dir=self.plans_dir, suffix='.tmp', delete=False) as temp_file:
+                temp_path = temp_file.name
+                temp_file.write(payload)
                 
-            shutil.move(temp_file.name, plan_path)
+            os.replace(temp_path, plan_path)
             logger.debug(f"Plan saved to {plan_path}")
             
         except Exception as e:
             logger.error(f"Error saving plan to disk: {e}")
+            if temp_path and os.path.exists(temp_path):
+                os.remove(temp_path)
     
     def get_plan(self, plan_id):
         """
@@ -875,8 +1206,8 @@ class LLMIntegration:
             # Pull from step_results if present
             sr_key = str(n)
             sr = step_results.get(sr_key, {})
-            stdout = sr.get('stdout', '')
-            stderr = sr.get('stderr', '')
+            stdout = self._clip_output(sr.get('stdout', ''))
+            stderr = self._clip_output(sr.get('stderr', ''))
             
             executed_info.append(f"Step {n} ({status}): {desc}\nOutput: {stdout}\nErrors: {stderr}")
 
@@ -890,24 +1221,7 @@ class LLMIntegration:
         upcoming_text = "\n".join(upcoming_desc)
 
         # Prepare prompt
-        system_prompt = """
-        You are a summarization assistant. Given the history of executed steps and the remaining steps,
-        provide two things: 
-        1) A short summary of what has been done so far.
-        2) Updated or revised steps for the remaining plan if needed.
-        
-        Return JSON with keys "summary" and "updated_steps".
-        "updated_steps" can be an array of step objects like:
-        [
-        {
-            "number": 3,
-            "description": "New desc",
-            "command": "ls -la"
-        },
-        ...
-        ]
-        If no changes are needed to the next steps, just repeat them.
-        """
+        system_prompt = _SUMMARIZE_SYSTEM_PROMPT
 
         user_content = f"""
         Executed Steps So Far:
@@ -921,16 +1235,18 @@ class LLMIntegration:
         response = self._call_gemini_api(system_prompt, user_content)
 
         # Parse JSON from the response
-        import re, json
-        match = re.search(r'{[\s\S]*}', response)
-        if match:
+        json_str = self._extract_json_str(response) if response else None
+        if json_str:
             try:
-                data = json.loads(match.group(0))
-                summary = data.get('summary', 'No summary provided.')
-                updated_steps = data.get('updated_steps', [])
-                return summary, updated_steps
-            except:
-                pass
+                data = json.loads(json_str)
+            except json.JSONDecodeError as e:
+                logger.warning(f"Could not parse progress summary response: {e}. Snippet: {response[:200]}")
+            else:
+                if isinstance(data, dict):
+                    self._cache_response(system_prompt, user_content, response)
+                    summary = data.get('summary', 'No summary provided.')
+                    updated_steps = data.get('updated_steps', [])
+                    return summary, updated_steps
 
         # Fallback
         return "Could not parse summary", remaining_steps
\ No newline at end of file
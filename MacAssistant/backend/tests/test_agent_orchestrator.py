@@ -0,0 +1,129 @@
+import unittest
+from unittest.mock import patch, MagicMock
+import sys
+import os
+
+# Add the backend directory to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from modules.agent_orchestrator import AgentOrchestrator
+from modules.llm_integration import clip_output
+from config import TestingConfig
+
+# Suppress logging during tests
+import logging
+logging.disable(logging.CRITICAL)
+
+class TestAgentOrchestrator(unittest.TestCase):
+
+    def setUp(self):
+        self.test_config = TestingConfig()
+        self.test_config.REVISION_CACHE_ENABLED = True
+        self.test_config.REVISION_CACHE_SIZE = 2
+
+        self.active_config_patcher = patch('modules.agent_orchestrator.active_config', self.test_config)
+        self.active_config_patcher.start()
+
+        self.llm_integration = MagicMock()
+        self.llm_integration.revise_plan.side_effect = self._fake_revise_plan
+        self.orchestrator = self._make_orchestrator()
+
+    def tearDown(self):
+        self.active_config_patcher.stop()
+
+    def _make_orchestrator(self):
+        return AgentOrchestrator(self.llm_integration, MagicMock(), MagicMock(), MagicMock(), MagicMock())
+
+    def _fake_revise_plan(self, plan_id, feedback, step_results):
+        return {
+            'id': f"revised-{feedback}",
+            'steps': [{'number': 1, 'description': feedback, 'command': 'true', 'status': 'pending'}],
+            'revision_summary': 'ok',
+        }
+
+    # --- Revision cache ---
+
+    def test_revision_cache_miss_calls_llm(self):
+        revised = self.orchestrator._revise_plan_cached("plan1", "fix it", {})
+
+        self.assertEqual(revised['id'], "revised-fix it")
+        self.llm_integration.revise_plan.assert_called_once_with("plan1", "fix it", {})
+        self.llm_integration.register_revised_plan.assert_not_called()
+        self.assertEqual(len(self.orchestrator.revision_cache), 1)
+
+    def test_revision_cache_hit_reuses_and_registers_fresh_copy(self):
+        first = self.orchestrator._revise_plan_cached("plan1", "fix it", {"1": {"stdout": "x"}})
+        first['steps'][0]['status'] = 'completed' # Execution mutates the active plan
+        second = self.orchestrator._revise_plan_cached("plan1", "fix it", {"1": {"stdout": "x"}})
+
+        self.llm_integration.revise_plan.assert_called_once()
+        self.assertEqual(second['id'], first['id'])
+        self.assertIsNot(second, first)
+        self.assertEqual(second['steps'][0]['status'], 'pending')
+        self.llm_integration.register_revised_plan.assert_called_once_with(second, "plan1")
+
+    def test_revision_cache_keyed_on_step_results(self):
+        self.orchestrator._revise_plan_cached("plan1", "fix it", {"1": {"stdout": "x"}})
+        self.orchestrator._revise_plan_cached("plan1", "fix it", {"1": {"stdout": "y"}})
+
+        self.assertEqual(self.llm_integration.revise_plan.call_count, 2)
+
+    def test_revision_cache_evicts_least_recently_used(self):
+        self.orchestrator._revise_plan_cached("plan1", "a", {})
+        self.orchestrator._revise_plan_cached("plan1", "b", {})
+        self.orchestrator._revise_plan_cached("plan1", "c", {}) # Evicts "a" (REVISION_CACHE_SIZE = 2)
+        self.assertEqual(self.llm_integration.revise_plan.call_count, 3)
+
+        self.orchestrator._revise_plan_cached("plan1", "c", {})
+        self.assertEqual(self.llm_integration.revise_plan.call_count, 3)
+        self.orchestrator._revise_plan_cached("plan1", "a", {})
+        self.assertEqual(self.llm_integration.revise_plan.call_count, 4)
+
+    def test_revision_cache_skips_errors(self):
+        self.llm_integration.revise_plan.side_effect = None
+        self.llm_integration.revise_plan.return_value = {'id': None, 'steps': [], 'status': 'error', 'error': 'bad'}
+
+        self.orchestrator._revise_plan_cached("plan1", "fix it", {})
+        self.orchestrator._revise_plan_cached("plan1", "fix it", {})
+
+        self.assertEqual(self.llm_integration.revise_plan.call_count, 2)
+        self.assertEqual(len(self.orchestrator.revision_cache), 0)
+
+    def test_revision_cache_disabled(self):
+        self.test_config.REVISION_CACHE_ENABLED = False
+        orchestrator = self._make_orchestrator()
+
+        orchestrator._revise_plan_cached("plan1", "fix it", {})
+        orchestrator._revise_plan_cached("plan1", "fix it", {})
+
+        self.assertEqual(self.llm_integration.revise_plan.call_count, 2)
+        self.assertEqual(len(orchestrator.revision_cache), 0)
+
+    # --- Step result compaction ---
+
+    def test_compact_step_results_clips_like_prompts(self):
+        self.test_config.LLM_OUTPUT_SLICE = 40
+        stdout = "HEAD" + "x" * 100 + "TAIL"
+        step_results = {"1": {"stdout": stdout, "stderr": "xy", "status": "completed"}, "2": {"stdout": None}}
+
+        compact = self.orchestrator._compact_step_results("plan1", step_results)
+
+        self.assertEqual(compact["1"]["stdout"], clip_output(stdout, 40))
+        self.assertLessEqual(len(compact["1"]["stdout"]), 40)
+        self.assertTrue(compact["1"]["stdout"].startswith("HEAD"))
+        self.assertTrue(compact["1"]["stdout"].endswith("TAIL"))
+        self.assertEqual(compact["1"]["stderr"], "xy")
+        self.assertEqual(compact["1"]["status"], "completed")
+        self.assertEqual(compact["2"], {"stdout": "", "stderr": ""})
+        self.assertEqual(step_results["1"]["stdout"], stdout) # The plan's own results are untouched
+        self.orchestrator.logger.log_info.assert_called_once()
+
+    def test_compact_step_results_zero_slice(self):
+        self.test_config.LLM_OUTPUT_SLICE = 0
+
+        compact = self.orchestrator._compact_step_results("plan1", {"1": {"stdout": "abc", "stderr": "err"}})
+
+        self.assertEqual(compact, {"1": {"stdout": "", "stderr": ""}})
+
+if __name__ == '__main__':
+    unittest.main()
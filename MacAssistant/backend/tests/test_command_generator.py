@@ -3,14 +3,12 @@ from unittest.mock import patch, MagicMock, mock_open
 import sys
 import os
 import json
-import asyncio
-from concurrent.futures import TimeoutError as FuturesTimeoutError
+import re
 
 # Add the backend directory to sys.path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from modules.command_generator import CommandGenerator
-from modules.llm_integration import global_loop as command_generator_global_loop # Import the loop
 from config import TestingConfig
 
 # Suppress logging during tests
@@ -31,7 +29,8 @@ class TestCommandGenerator(unittest.TestCase):
         self.active_config_patcher = patch('modules.command_generator.active_config', self.test_config)
         self.mock_active_config = self.active_config_patcher.start()
 
-        # Mock templates file loading
+        # Mock templates file loading; drop templates cached by earlier instances
+        CommandGenerator._templates_cache.clear()
         self.templates_patcher = patch.object(CommandGenerator, '_load_templates', return_value=self._get_mock_templates())
         self.mock_load_templates = self.templates_patcher.start()
 
@@ -40,6 +39,7 @@ class TestCommandGenerator(unittest.TestCase):
     def tearDown(self):
         self.active_config_patcher.stop()
         self.templates_patcher.stop()
+        CommandGenerator._templates_cache.clear()
 
     def _get_mock_templates(self):
         return {
@@ -64,17 +64,88 @@ class TestCommandGenerator(unittest.TestCase):
         command = self.command_generator.generate_command("This is a test keyword for a file named mydoc.txt please.")
         self.assertEqual(command, "touch mydoc.txt")
 
+    def test_templates_lowercased_at_load(self):
+        self.assertEqual(self.command_generator.templates['exact'][0]['pattern_lc'], "show test exact")
+        self.assertEqual(self.command_generator.templates['_exact_index'], {"show test exact": "echo 'exact template test'"})
+        self.assertEqual(self.command_generator.templates['keywords'][0]['keywords_lc'], ["test keyword", "file"])
+        command = self.command_generator.generate_command("Show Test EXACT")
+        self.assertEqual(command, "echo 'exact template test'")
+
+    def test_keyword_template_matches_whole_words_only(self):
+        template = self.command_generator.templates['keywords'][0]
+        self.assertEqual(template['kw_set'], frozenset(["file"]))
+        self.assertEqual(template['kw_phrases'], ("test keyword",))
+        self.assertEqual(self.command_generator.templates['_keyword_index'], {"file": [0]})
+        self.command_generator.llm_available = False
+        # "profile" contains "file" as a substring but not as a word
+        command = self.command_generator.generate_command("test keyword profile named mydoc.txt")
+        self.assertEqual(command, 'echo "No command generated for: test keyword profile named mydoc.txt"')
+
+    def test_keyword_template_extractors_precompiled(self):
+        template = self.command_generator.templates['keywords'][0]
+        self.assertEqual(template['_placeholders'], ["filename"])
+        self.assertEqual(template['_extractors_compiled']['filename'].pattern, "file named (\\w+\\.txt)")
+        self.assertTrue(template['_extractors_compiled']['filename'].flags & re.IGNORECASE)
+
+    def test_keyword_template_keeps_literal_braces(self):
+        self.command_generator.templates = self.command_generator._normalize_templates({
+            "exact": [],
+            "keywords": [{
+                "keywords": ["columns"],
+                "command": "awk '{print $1\":\"$2}' {filename}",
+                "extractors": {"filename": "of (\\S+)"}
+            }]
+        })
+        command = self.command_generator.generate_command("print columns of data.csv")
+        self.assertEqual(command, "awk '{print $1\":\"$2}' data.csv")
+
+    def test_templates_loaded_once_per_process(self):
+        other_generator = CommandGenerator()
+        self.mock_load_templates.assert_called_once()
+        self.assertIs(other_generator.templates, self.command_generator.templates)
+
     def test_generate_command_pattern_match_python_version(self):
         command = self.command_generator.generate_command("check python --version")
         self.assertEqual(command, "python --version")
 
     def test_generate_command_pattern_match_create_file(self):
         command = self.command_generator.generate_command("Create file 'test.txt' with content \"hello world\"")
-        self.assertEqual(command, 'echo "hello world" > test.txt')
+        self.assertEqual(command, "echo 'hello world' > test.txt")
         
         command_no_content = self.command_generator.generate_command("Create file named anothertest.log")
-        self.assertEqual(command_no_content, 'echo "" > anothertest.log')
+        self.assertEqual(command_no_content, "echo '' > anothertest.log")
+
+        command_contents = self.command_generator.generate_command("create a file called notes.md with contents 'todo'")
+        self.assertEqual(command_contents, "echo todo > notes.md")
+
+    def test_create_file_content_is_shell_quoted(self):
+        command = self._process_patterns("create file x.txt with content $(whoami)")
+        self.assertEqual(command, "echo '$(whoami)' > x.txt")
+
+
+    def _process_patterns(self, task_description):
+        return self.command_generator._process_patterns(task_description, task_description.lower())
 
+    def test_process_patterns_matches_whole_task(self):
+        self.assertEqual(self._process_patterns("version of python3"), "python3 --version")
+        self.assertEqual(self._process_patterns("  Check the Python version?"), "python --version")
+        self.assertIsNone(self._process_patterns("nothing to see here"))
+
+    def test_process_patterns_ignore_phrases_inside_longer_tasks(self):
+        for task in ("Install the latest python version with pyenv",
+                     "Kill all running processes named Safari",
+                     "Check disk usage of the Downloads folder",
+                     "Ping google.com 10 times",
+                     "Open Terminal and run htop",
+                     "Delete the file notes.txt from my Desktop",
+                     "Create file a.txt in ~/Desktop"):
+            self.assertIsNone(self._process_patterns(task), task)
+
+    @patch('modules.command_generator._DISPATCH_RE')
+    def test_process_patterns_prefix_fast_path(self, mock_dispatch_re):
+        self.assertEqual(self._process_patterns("Create file todo.txt"), "echo '' > todo.txt")
+        self.assertIsNone(self._process_patterns("Create file todo.txt on the Desktop"))
+        mock_dispatch_re.fullmatch.assert_not_called()
 
     def test_generate_command_no_match_fallback(self):
         # Ensure LLM is disabled for this specific test to check fallback
@@ -84,39 +155,39 @@ class TestCommandGenerator(unittest.TestCase):
         self.assertEqual(command, f'echo "No command generated for: {task_desc}"')
         self.command_generator.llm_available = self.test_config.USE_LLM_COMMAND_GENERATION # Restore
 
+    def test_shipped_templates_do_not_hijack_tasks(self):
+        with open(self.command_generator.templates_file) as f:
+            self.command_generator.templates = self.command_generator._normalize_templates(json.load(f))
+        self.command_generator.llm_available = False
+        self.assertEqual(self.command_generator.generate_command("Show current directory"), "pwd")
+        for task in ("Make sure the directory is writable",
+                     "Make the directory structure for the project",
+                     "Open application settings and make a new directory called x"):
+            self.assertEqual(self.command_generator.generate_command(task), f'echo "No command generated for: {task}"')
+
+    @patch('modules.command_generator.CommandGenerator._generate_command_with_llm')
+    def test_local_matches_skip_llm(self, mock_llm):
+        # Templates are tried first, then patterns, and only then the LLM
+        self.assertEqual(self.command_generator.generate_command("show test exact"), "echo 'exact template test'")
+        self.assertEqual(self.command_generator.generate_command("check python3 version"), "python3 --version")
+        mock_llm.assert_not_called()
+
     # --- LLM-based Command Generation Tests ---
-    @patch('modules.command_generator.CommandGenerator._async_generate_command_with_llm')
-    # Patch the global_loop imported into command_generator, not the one in llm_integration
-    @patch('modules.command_generator.global_loop') 
-    def test_generate_command_with_llm_success(self, mock_command_gen_global_loop, mock_async_gen_cmd_llm):
+    @patch('modules.command_generator.CommandGenerator._request_command_from_llm')
+    def test_generate_command_with_llm_success(self, mock_request_command):
         expected_llm_command = "ls -l /tmp"
-        
-        # Configure the mock executor on the instance
-        mock_executor_future = MagicMock()
-        mock_executor_future.result.return_value = expected_llm_command
-        self.command_generator.executor.submit = MagicMock(return_value=mock_executor_future)
+        mock_request_command.return_value = expected_llm_command
         
         task_description = "list files in temp directory with details"
         # This call will go through _generate_command_with_llm
         command = self.command_generator.generate_command(task_description) 
 
         self.assertEqual(command, expected_llm_command)
-        self.command_generator.executor.submit.assert_called_once()
-        call_args = self.command_generator.executor.submit.call_args
-        self.assertEqual(call_args[0][0], mock_command_gen_global_loop.run_until_complete)
-        
-        # The coroutine is the result of calling _async_generate_command_with_llm
-        mock_async_gen_cmd_llm.assert_called_once_with(task_description)
-        self.assertEqual(call_args[0][1], mock_async_gen_cmd_llm.return_value)
-        
-        mock_executor_future.result.assert_called_once_with(timeout=self.test_config.LLM_TIMEOUT)
-
-    @patch('modules.command_generator.CommandGenerator._async_generate_command_with_llm')
-    @patch('modules.command_generator.global_loop')
-    def test_generate_command_with_llm_api_error(self, mock_command_gen_global_loop, mock_async_gen_cmd_llm):
-        mock_executor_future = MagicMock()
-        mock_executor_future.result.side_effect = Exception("LLM Gen Error")
-        self.command_generator.executor.submit = MagicMock(return_value=mock_executor_future)
+        mock_request_command.assert_called_once_with(task_description)
+
+    @patch('modules.command_generator.CommandGenerator._request_command_from_llm')
+    def test_generate_command_with_llm_api_error(self, mock_request_command):
+        mock_request_command.side_effect = Exception("LLM Gen Error")
         
         task_description = "a complex task for llm"
         # generate_command catches the exception from _generate_command_with_llm and logs it.
@@ -124,76 +195,149 @@ class TestCommandGenerator(unittest.TestCase):
         command = self.command_generator.generate_command(task_description)
         
         self.assertEqual(command, f'echo "No command generated for: {task_description}"')
-        mock_executor_future.result.assert_called_once_with(timeout=self.test_config.LLM_TIMEOUT)
+        mock_request_command.assert_called_once_with(task_description)
 
+    def test_genai_client_timeout_from_config(self):
+        with patch('google.genai.Client') as MockGenAIClient:
+            CommandGenerator()
+        _, kwargs = MockGenAIClient.call_args
+        self.assertEqual(kwargs['http_options'].timeout, int(self.test_config.LLM_TIMEOUT * 1000))
 
-    @patch('modules.command_generator.CommandGenerator._async_generate_command_with_llm')
-    @patch('modules.command_generator.global_loop')
-    def test_generate_command_with_llm_timeout(self, mock_command_gen_global_loop, mock_async_gen_cmd_llm):
-        mock_executor_future = MagicMock()
-        mock_executor_future.result.side_effect = FuturesTimeoutError("LLM Gen Timeout")
-        self.command_generator.executor.submit = MagicMock(return_value=mock_executor_future)
+    @patch('modules.command_generator.CommandGenerator._request_command_from_llm')
+    def test_generate_command_with_llm_timeout(self, mock_request_command):
+        mock_request_command.side_effect = TimeoutError("LLM Gen Timeout")
 
         task_description = "another complex task for llm"
         # Similar to API error, timeout should be caught and lead to fallback.
         command = self.command_generator.generate_command(task_description)
 
         self.assertEqual(command, f'echo "No command generated for: {task_description}"')
-        mock_executor_future.result.assert_called_once_with(timeout=self.test_config.LLM_TIMEOUT)
 
-    # Test the actual _async_generate_command_with_llm method
-    @patch('modules.command_generator.genai.Client')
-    def test_async_generate_command_with_llm_actual_logic(self, MockGenAIClient):
+    @patch('modules.command_generator.CommandGenerator._request_command_from_llm')
+    def test_llm_skipped_for_non_task_input(self, mock_request_command):
+        for task_description in ["", "ab", "12345 !!"]:
+            self.command_generator.generate_command(task_description)
+        mock_request_command.assert_not_called()
+
+    def test_rejected_llm_output_not_requested_again(self):
+        mock_genai_instance = MagicMock()
+        mock_genai_instance.models.generate_content_stream.return_value = [MagicMock(text="sudo rm -rf /")]
+        self.command_generator._genai_client = mock_genai_instance
+
+        task_description = "wipe everything please"
+        self.command_generator.generate_command(task_description)
+        command = self.command_generator.generate_command(task_description)
+
+        self.assertEqual(command, f'echo "No command generated for: {task_description}"')
+        mock_genai_instance.models.generate_content_stream.assert_called_once()
+
+    @patch('modules.command_generator.CommandGenerator._request_command_from_llm')
+    def test_generated_commands_cached_per_task(self, mock_request_command):
+        mock_request_command.return_value = "ls -l /tmp"
+        self.command_generator.generate_command("list files in temp")
+        self.command_generator.generate_command("  list files in temp\n")
+        mock_request_command.assert_called_once()
+
+        # Case is significant, and time-sensitive tasks always regenerate
+        self.command_generator.generate_command("List files in TEMP")
+        self.command_generator.generate_command("show current files in temp")
+        self.command_generator.generate_command("show current files in temp")
+        self.assertEqual(mock_request_command.call_count, 4)
+
+    # Test the actual _request_command_from_llm method
+    def test_request_command_from_llm_actual_logic(self):
         mock_genai_instance = MagicMock()
         mock_genai_response = MagicMock()
         mock_genai_response.text = "touch test_file.txt" # Expected command
-        mock_genai_instance.models.generate_content.return_value = mock_genai_response
-        MockGenAIClient.return_value = mock_genai_instance
+        mock_genai_instance.models.generate_content_stream.return_value = [mock_genai_response]
+        self.command_generator._genai_client = mock_genai_instance
 
         task_description = "create a test file"
         
-        # Run the async method using the global_loop imported by command_generator
-        # This loop is originally from llm_integration
-        actual_command = command_generator_global_loop.run_until_complete(
-            self.command_generator._async_generate_command_with_llm(task_description)
-        )
+        actual_command = self.command_generator._request_command_from_llm(task_description)
 
         self.assertEqual(actual_command, "touch test_file.txt")
-        MockGenAIClient.assert_called_once_with(api_key=self.test_config.GEMINI_API_KEY)
         
-        args, kwargs = mock_genai_instance.models.generate_content.call_args
+        args, kwargs = mock_genai_instance.models.generate_content_stream.call_args
         self.assertEqual(kwargs['model'], self.test_config.GEMINI_MODEL)
-        # Check that generation_config from the method is used
-        self.assertEqual(kwargs['generation_config']['temperature'], self.test_config.COMMAND_TEMPERATURE)
+        # Check that the prebuilt generation config is used
+        self.assertIs(kwargs['config'], self.command_generator._generation_config)
+        self.assertEqual(kwargs['config'].temperature, self.test_config.COMMAND_TEMPERATURE)
         self.assertTrue(f"Task: {task_description}" in str(kwargs['contents'][0]))
+        self.assertIn("Return ONLY one", kwargs['config'].system_instruction)
 
 
-    @patch('modules.command_generator.genai.Client')
-    def test_async_generate_command_llm_dangerous_command_filter(self, MockGenAIClient):
+    def test_request_command_from_llm_dangerous_command_filter(self):
         mock_genai_instance = MagicMock()
         mock_genai_response = MagicMock()
         mock_genai_response.text = "sudo rm -rf /" 
-        mock_genai_instance.models.generate_content.return_value = mock_genai_response
-        MockGenAIClient.return_value = mock_genai_instance
+        mock_genai_instance.models.generate_content_stream.return_value = [mock_genai_response]
+        self.command_generator._genai_client = mock_genai_instance
         
-        actual_command = command_generator_global_loop.run_until_complete(
-            self.command_generator._async_generate_command_with_llm("do something very risky")
-        )
+        actual_command = self.command_generator._request_command_from_llm("do something very risky")
         self.assertIsNone(actual_command) # Dangerous command should be filtered
 
-    @patch('modules.command_generator.genai.Client')
-    def test_async_generate_command_llm_code_block_extraction(self, MockGenAIClient):
+    def test_request_command_from_llm_code_block_extraction(self):
         mock_genai_instance = MagicMock()
         mock_genai_response = MagicMock()
         mock_genai_response.text = "Here is the command:\n```bash\nls -la\n```\nExecute it."
-        mock_genai_instance.models.generate_content.return_value = mock_genai_response
-        MockGenAIClient.return_value = mock_genai_instance
+        mock_genai_instance.models.generate_content_stream.return_value = [mock_genai_response]
+        self.command_generator._genai_client = mock_genai_instance
         
-        actual_command = command_generator_global_loop.run_until_complete(
-            self.command_generator._async_generate_command_with_llm("list files with details")
-        )
+        actual_command = self.command_generator._request_command_from_llm("list files with details")
         self.assertEqual(actual_command, "ls -la")
 
+    def test_genai_not_set_up_when_llm_disabled(self):
+        self.test_config.USE_LLM_COMMAND_GENERATION = False
+        with patch('google.genai.Client') as MockGenAIClient:
+            command_generator = CommandGenerator()
+        MockGenAIClient.assert_not_called()
+        self.assertIsNone(command_generator._genai_client)
+        self.assertIsNone(command_generator._genai_types)
+
+    def test_request_command_from_llm_picks_command_line(self):
+        mock_genai_instance = MagicMock()
+        mock_genai_instance.models.generate_content_stream.return_value = [
+            MagicMock(text="Sure, else I would help.\nls -la ~/Documents\nThis lists files.")
+        ]
+        self.command_generator._genai_client = mock_genai_instance
+
+        actual_command = self.command_generator._request_command_from_llm("list my documents")
+        self.assertEqual(actual_command, "ls -la ~/Documents")
+
+    def _stream_chunks(self, texts):
+        """Point the client at a stream of the given chunk texts; returns the list of consumed chunks."""
+        consumed = []
+        def stream(**kwargs):
+            for text in texts:
+                consumed.append(text)
+                yield MagicMock(text=text)
+        mock_genai_instance = MagicMock()
+        mock_genai_instance.models.generate_content_stream.side_effect = stream
+        self.command_generator._genai_client = mock_genai_instance
+        return consumed
+
+    def test_request_command_from_llm_stops_stream_early(self):
+        consumed = self._stream_chunks(["```bash\nls -la", " ~/Desktop\n```", "\nThis lists"])
+
+        actual_command = self.command_generator._request_command_from_llm("list my desktop")
+        self.assertEqual(actual_command, "ls -la ~/Desktop")
+        self.assertEqual(len(consumed), 2) # The trailing prose is never read
+
+    def test_request_command_from_llm_waits_for_later_code_block(self):
+        consumed = self._stream_chunks(["To find the files, use:\n", "```bash\nfind . -name x\n```"])
+
+        actual_command = self.command_generator._request_command_from_llm("find x")
+        self.assertEqual(actual_command, "find . -name x")
+        self.assertEqual(len(consumed), 2)
+
+    @patch('google.genai.Client')
+    def test_genai_client_built_once_and_reused(self, MockGenAIClient):
+        command_generator = CommandGenerator()
+        MockGenAIClient.assert_called_once()
+        self.assertEqual(MockGenAIClient.call_args.kwargs['api_key'], self.test_config.GEMINI_API_KEY)
+        self.assertIs(command_generator._genai_client, MockGenAIClient.return_value)
+
 
 if __name__ == '__main__':
     # Re-enable logging if running tests directly for debugging
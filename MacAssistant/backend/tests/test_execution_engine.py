@@ -0,0 +1,176 @@
+import unittest
+from unittest.mock import patch
+import sys
+import os
+import re
+import stat
+import tempfile
+import time
+
+# Add the backend directory to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from modules.execution_engine import ExecutionEngine
+from config import TestingConfig
+
+# Suppress logging during tests
+import logging
+logging.disable(logging.CRITICAL)
+
+class TestExecutionEngine(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.test_config = TestingConfig()
+        self.test_config.MAX_EXECUTION_TIME = 10
+        self.test_config.EXECUTION_LOCATION = self.temp_dir.name
+
+        self.active_config_patcher = patch('modules.execution_engine.active_config', self.test_config)
+        self.active_config_patcher.start()
+
+        self.engine = ExecutionEngine()
+
+    def tearDown(self):
+        self.active_config_patcher.stop()
+        self.temp_dir.cleanup()
+
+    def _path(self, name):
+        return os.path.join(self.temp_dir.name, name)
+
+    # --- Shell-less pipelines and redirects ---
+
+    def test_pipe_runs_without_shell(self):
+        with patch.object(ExecutionEngine, '_run_process') as mock_run_process:
+            success, stdout, stderr = self.engine.execute("echo hello | tr a-z A-Z")
+        mock_run_process.assert_not_called()
+        self.assertTrue(success)
+        self.assertEqual(stdout, "HELLO\n")
+        self.assertEqual(stderr, "")
+
+    def test_redirect_truncates_and_appends(self):
+        with patch.object(ExecutionEngine, '_run_process') as mock_run_process:
+            self.assertTrue(self.engine.execute("echo one > out.txt")[0])
+            self.assertTrue(self.engine.execute("echo two >> out.txt")[0])
+            success, stdout, _ = self.engine.execute("echo three | tr a-z A-Z >> out.txt")
+        mock_run_process.assert_not_called()
+        self.assertTrue(success)
+        self.assertEqual(stdout, "")
+        with open(self._path("out.txt")) as f:
+            self.assertEqual(f.read(), "one\ntwo\nTHREE\n")
+
+        self.assertTrue(self.engine.execute("echo reset > out.txt")[0])
+        with open(self._path("out.txt")) as f:
+            self.assertEqual(f.read(), "reset\n")
+
+    def test_quoted_operators_stay_in_arguments(self):
+        success, stdout, _ = self.engine.execute("echo 'a | b' \"c > d\"")
+        self.assertTrue(success)
+        self.assertEqual(stdout, "a | b c > d\n")
+        self.assertFalse(os.path.exists(self._path("d")))
+
+    def test_split_simple_pipeline_resolves_executables(self):
+        stages, redirect_path, append = self.engine._split_simple_pipeline("echo 'x y' | cat > out.txt")
+        self.assertEqual([argv for _, argv in stages], [["echo", "x y"], ["cat"]])
+        self.assertTrue(all(os.path.isabs(executable) for executable, _ in stages))
+        self.assertEqual(redirect_path, "out.txt")
+        self.assertFalse(append)
+
+    def test_shell_only_syntax_goes_to_shell(self):
+        for command in ("echo $((1 + 2)) | cat", "echo a && echo b", "ls *.txt | wc -l", "echo hi 2>&1 | cat"):
+            self.assertIsNone(self.engine._split_simple_pipeline(command), command)
+        self.assertEqual(self.engine.execute("echo $((1 + 2)) | cat")[1], "3\n")
+        self.assertEqual(self.engine.execute("echo a && echo b")[1], "a\nb\n")
+
+    def test_unknown_program_goes_to_shell_before_anything_runs(self):
+        self.assertIsNone(self.engine._split_simple_pipeline("mkdir newdir | nonexistent_cmd_xyz"))
+        success, _, stderr = self.engine.execute("mkdir newdir | nonexistent_cmd_xyz")
+        self.assertFalse(success)
+        self.assertTrue(os.path.isdir(self._path("newdir")))
+        self.assertNotIn("File exists", stderr)
+
+    def test_later_stage_launch_failure_is_not_rerun_in_shell(self):
+        # Executable but not a valid program, so it resolves yet fails to start
+        bad_program = self._path("bad_program")
+        with open(bad_program, "w") as f:
+            f.write("not a program\n")
+        os.chmod(bad_program, stat.S_IRWXU)
+
+        with patch.object(ExecutionEngine, '_run_process') as mock_run_process:
+            success, stdout, stderr = self.engine.execute("mkdir newdir | ./bad_program")
+        mock_run_process.assert_not_called()
+        self.assertFalse(success)
+        self.assertEqual(stdout, "")
+        self.assertIn("Error executing command", stderr)
+        self.assertNotIn("File exists", stderr)
+        self.assertTrue(os.path.isdir(self._path("newdir")))
+
+    def test_pipeline_shares_one_deadline(self):
+        # The first stage closes its stdout and hangs after the last stage has used most of the budget
+        self.engine.max_execution_time = 2
+        command = ("python3 -c \"import os, time; os.close(1); time.sleep(30)\""
+                   " | python3 -c \"import time; time.sleep(1.5)\"")
+        self.assertIsNotNone(self.engine._split_simple_pipeline(command))
+
+        start = time.monotonic()
+        success, stdout, stderr = self.engine.execute(command)
+        elapsed = time.monotonic() - start
+
+        self.assertFalse(success)
+        self.assertIn("timed out", stderr)
+        self.assertLess(elapsed, 3)
+
+    # --- Placeholder checks ---
+
+    def test_unsubstituted_placeholder_rejected(self):
+        for command in ("mkdir {dirname}", "cat \"{filename}\" | wc -l", "cp {path} /tmp"):
+            success, stdout, stderr = self.engine.execute(command)
+            self.assertFalse(success, command)
+            self.assertIn("unsubstituted placeholder", stderr)
+        self.assertFalse(os.path.exists(self._path("{dirname}")))
+
+    def test_shell_braces_are_not_placeholders(self):
+        success, _, stderr = self.engine.execute("echo ${HOME}")
+        self.assertTrue(success)
+        self.assertNotIn("placeholder", stderr)
+        success, stdout, _ = self.engine.execute("awk 'BEGIN{print}'")
+        self.assertTrue(success)
+        self.assertEqual(stdout, "\n")
+        success, _, stderr = self.engine.execute("echo ${folder}x")
+        self.assertTrue(success)
+        self.assertNotIn("placeholder", stderr)
+
+    # --- Bounded output capture ---
+
+    def test_output_truncated_to_tail(self):
+        self.engine.max_output_size = 8192
+        success, stdout, _ = self.engine.execute("python3 -c \"print('x' * 20000, end='')\"")
+        self.assertTrue(success)
+        match = re.match(r"\[\.\.\. (\d+) earlier characters of output truncated \.\.\.\]\n", stdout)
+        self.assertIsNotNone(match)
+        kept = stdout[match.end():]
+        self.assertLessEqual(len(kept), 8192)
+        self.assertEqual(int(match.group(1)) + len(kept), 20000)
+        self.assertEqual(kept, 'x' * len(kept))
+
+    def test_output_within_limit_not_truncated(self):
+        success, stdout, _ = self.engine.execute("python3 -c \"print('x' * 100, end='')\"")
+        self.assertTrue(success)
+        self.assertEqual(stdout, 'x' * 100)
+
+    def test_non_utf8_output_is_replaced(self):
+        success, stdout, stderr = self.engine.execute(
+            "python3 -c \"import sys; sys.stdout.buffer.write(b'ok\\xff\\xfe\\n')\"")
+        self.assertTrue(success)
+        self.assertEqual(stdout, "ok\ufffd\ufffd\n")
+        self.assertEqual(stderr, "")
+
+    def test_large_non_utf8_output_keeps_draining(self):
+        # Far more than a pipe buffer holds; the child would block if the reader died
+        self.engine.max_execution_time = 5
+        success, stdout, _ = self.engine.execute(
+            "python3 -c \"import sys; sys.stdout.buffer.write(b'\\xff' * 500000)\"")
+        self.assertTrue(success)
+        self.assertTrue(stdout.endswith("\ufffd" * 100))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,6 +3,7 @@ import sys
 import os
 import json
 import logging
+from unittest.mock import patch
 
 # Add the backend directory to sys.path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
@@ -77,6 +78,15 @@ class TestLLMIntegrationParsing(unittest.TestCase):
         self.assertIn("'plan' key is missing or not a list", parsed_data.get('message', ''))
         self.assertIn(response_text[:200], parsed_data.get('raw_response_snippet', ''))
 
+    def test_parse_non_plan_text_fails_fast(self):
+        response_text = "I'm sorry, I can't help with that."
+        with patch('modules.llm_integration.json.loads') as mock_loads:
+            parsed_data = self.llm_integration_instance._parse_plan_with_commands(response_text)
+        mock_loads.assert_not_called()
+        self.assertEqual(parsed_data.get('status'), 'error')
+        self.assertEqual(parsed_data.get('error_code'), 'VALIDATION_FAILED')
+        self.assertIn(response_text, parsed_data.get('raw_response_snippet', ''))
+
     def test_parse_plan_key_not_a_list(self):
         response_text = '{"plan": "This should be a list"}'
         parsed_data = self.llm_integration_instance._parse_plan_with_commands(response_text)
@@ -118,6 +128,12 @@ class TestLLMIntegrationParsing(unittest.TestCase):
         self.assertNotIn('error_code', parsed_data)
         self.assertEqual(parsed_data['steps'][0]['command'], "") # None command becomes empty string
 
+    def test_parse_command_non_string(self):
+        response_text = '{"plan": [{"number": 1, "description": "command is a number", "command": 42}]}'
+        parsed_data = self.llm_integration_instance._parse_plan_with_commands(response_text)
+        self.assertNotIn('error_code', parsed_data)
+        self.assertEqual(parsed_data['steps'][0]['command'], "") # Non-string command becomes empty string
+
     def test_parse_is_risky_is_observe_missing_or_invalid(self):
         response_text = """
         {
@@ -175,12 +191,31 @@ class TestLLMIntegrationParsing(unittest.TestCase):
         }
         Hope this helps!
         """
-        # The current regex `r'{\s*".*?":[\s\S]*}'` should find the JSON block.
+        # The balanced-brace scan should find the JSON block.
         parsed_data = self.llm_integration_instance._parse_plan_with_commands(response_text)
         self.assertNotIn('error_code', parsed_data, f"Parsing failed with error: {parsed_data.get('message')}")
         self.assertEqual(len(parsed_data['steps']), 1)
         self.assertEqual(parsed_data['steps'][0]['description'], "Just JSON with text")
 
+    def test_parse_bare_json_skips_regex_extraction(self):
+        response_text = '\n  {"plan": [{"number": 1, "description": "Bare JSON", "command": "pwd"}]}  \n'
+        with patch('modules.llm_integration._JSON_FENCE_RE') as mock_fence_re, \
+             patch.object(LLMIntegration, '_find_json_object') as mock_find_object:
+            parsed_data = self.llm_integration_instance._parse_plan_with_commands(response_text)
+        mock_fence_re.search.assert_not_called()
+        mock_find_object.assert_not_called()
+        self.assertNotIn('error_code', parsed_data)
+        self.assertEqual(parsed_data['steps'][0]['description'], "Bare JSON")
+
+    def test_find_json_object_stops_at_balancing_brace(self):
+        text = 'Note {not json}. {"plan": [{"description": "echo \\"}\\" {x}"}]} trailing {brace}'
+        self.assertEqual(LLMIntegration._find_json_object(text),
+                         '{"plan": [{"description": "echo \\"}\\" {x}"}]}')
+
+    def test_find_json_object_unbalanced_returns_none(self):
+        self.assertIsNone(LLMIntegration._find_json_object('{"plan": [{"number": 1}'))
+        self.assertIsNone(LLMIntegration._find_json_object('no object {here}'))
+
     def test_parse_revision_summary(self):
         response_text = """
         {
@@ -217,6 +252,18 @@ class TestLLMIntegrationParsing(unittest.TestCase):
         # Current implementation sets it to 'Revision summary was not a string or was missing.'
         self.assertEqual(parsed_data.get('revision_summary'), 'Revision summary was not a string or was missing.')
 
+    def test_plan_id_is_stable_and_content_addressed(self):
+        response_text = '{"plan": [{"number": 1, "description": "List files", "command": "ls"}]}'
+        first = self.llm_integration_instance._parse_plan_with_commands(response_text)
+        second = self.llm_integration_instance._parse_plan_with_commands(response_text)
+        other = self.llm_integration_instance._parse_plan_with_commands(response_text.replace('"ls"', '"ls -la"'))
+        self.assertEqual(first['id'], second['id'])
+        self.assertNotEqual(first['id'], other['id'])
+        # Independent of the per-process hash() seed
+        self.assertEqual(first['id'], LLMIntegration._plan_id(first['steps']))
+        self.assertRegex(first['id'], r'^[0-9a-f]{32}$')
+
+
 
     # --- Tests for verify_execution_result parsing ---
 
@@ -241,6 +288,63 @@ class TestLLMIntegrationParsing(unittest.TestCase):
         self.assertNotIn("error_code", result)
 
 
+    def test_verify_skips_llm_for_clean_read_only_commands(self):
+        def fail_if_called(sys_prompt, usr_msg):
+            raise AssertionError("LLM should not be called")
+        self.llm_integration_instance._call_gemini_api = fail_if_called
+
+        result = self.llm_integration_instance.verify_execution_result("Check disk space", "df -h", "Filesystem ...", "", True)
+        self.assertTrue(result['success'])
+        self.assertEqual(result['suggestion'], "")
+
+    def test_verify_uses_llm_for_writes_failures_and_stderr(self):
+        response_text = '{"success": false, "explanation": "Checked by LLM.", "suggestion": ""}'
+        self.llm_integration_instance._call_gemini_api = lambda sys_prompt, usr_msg: response_text
+
+        for command, stderr, success in [
+            ("ls -la > listing.txt", "", True),   # Redirection writes a file
+            ("find . -delete", "", True),         # Not a read-only utility
+            ("cat missing.txt", "No such file", True),
+            ("ls /nonexistent", "", False),
+            ("echo 'unbalanced", "", True),
+        ]:
+            result = self.llm_integration_instance.verify_execution_result("desc", command, "", stderr, success)
+            self.assertEqual(result['explanation'], "Checked by LLM.", command)
+
+    def test_verify_clips_long_output_in_prompt(self):
+        captured = {}
+        def fake_call(sys_prompt, usr_msg):
+            captured['message'] = usr_msg
+            return '{"success": true, "explanation": "ok", "suggestion": ""}'
+        self.llm_integration_instance._call_gemini_api = fake_call
+        self.llm_integration_instance.output_slice = 100
+        stdout = "HEAD" + "x" * 10000 + "TAIL"
+
+        self.llm_integration_instance.verify_execution_result("desc", "make build", stdout, "", True)
+
+        self.assertIn("HEAD", captured['message'])
+        self.assertIn("TAIL", captured['message'])
+        self.assertIn("chars elided", captured['message'])
+        self.assertLess(len(captured['message']), 1000)
+
+    def test_clip_output_tiny_slice(self):
+        text = "abcdef"
+        for output_slice, expected in [(0, ""), (1, "f"), (2, "ef")]:
+            self.llm_integration_instance.output_slice = output_slice
+            self.assertEqual(self.llm_integration_instance._clip_output(text), expected, output_slice)
+
+    def test_clip_output_fits_budget_and_is_idempotent(self):
+        self.llm_integration_instance.output_slice = 40
+        text = "HEAD" + "x" * 100 + "TAIL"
+
+        clipped = self.llm_integration_instance._clip_output(text)
+
+        self.assertLessEqual(len(clipped), 40)
+        self.assertTrue(clipped.startswith("HEAD"))
+        self.assertTrue(clipped.endswith("TAIL"))
+        self.assertIn("chars elided", clipped)
+        self.assertEqual(self.llm_integration_instance._clip_output(clipped), clipped)
+
     def test_verify_execution_missing_success_key(self):
         response_text = '{"explanation": "Forgot success.", "suggestion": "Add it."}'
         self.llm_integration_instance._call_gemini_api = lambda sys_prompt, usr_msg: response_text
@@ -293,6 +397,19 @@ class TestLLMIntegrationParsing(unittest.TestCase):
         self.assertEqual(result['suggestion'], "") # Should default to empty string
         self.assertNotIn("error_code", result)
 
+    # --- Tests for summarize_progress_and_update_plan ---
+
+    def test_summarize_ignores_braces_in_trailing_prose(self):
+        response_text = '{"summary": "Listed files.", "updated_steps": []}\nTip: wrap names like {this} in quotes.'
+        self.llm_integration_instance._call_gemini_api = lambda sys_prompt, usr_msg: response_text
+        step = {"number": 1, "description": "List files", "status": "completed"}
+
+        summary, updated_steps = self.llm_integration_instance.summarize_progress_and_update_plan(
+            [step], {"1": {"stdout": "a.txt", "stderr": ""}}, [])
+
+        self.assertEqual(summary, "Listed files.")
+        self.assertEqual(updated_steps, [])
+
 if __name__ == '__main__':
     # Re-enable logging if running tests directly for debugging
     # logging.disable(logging.NOTSET) 
@@ -107,5 +107,14 @@ class TestLRUCache(unittest.TestCase):
         self.assertEqual(cache.get('b'),2)
         self.assertEqual(len(cache),1)
 
+    def test_get_falsy_value_updates_recency(self):
+        cache = LRUCache(max_size=2)
+        cache.put('a', 0)
+        cache.put('b', '')
+        self.assertEqual(cache.get('a'), 0) # Falsy values are hits, not misses
+        self.assertEqual(list(cache.cache.keys()), ['b', 'a'])
+        cache.put('c', None) # evicts 'b'
+        self.assertEqual(list(cache.cache.keys()), ['a', 'c'])
+
 if __name__ == '__main__':
     unittest.main()